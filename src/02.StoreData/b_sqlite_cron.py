@@ -1,56 +1,293 @@
-import sqlite3
-from sys import argv
-
-import exchange_calendars as xcals
-import pandas as pd
-from openbb import obb
-
-obb.user.preferences.output_type = "dataframe"
-
-
-#################################
-def get_stock_data(symbol, start_date=None, end_date=None):
-    data = obb.equity.price.historical(
-        symbol,
-        start_date=start_date,
-        end_date=end_date,
-        provider="yfinance",
-    )
-    data.reset_index(inplace=True)
-    data["symbol"] = symbol
-    return data
-
-
-#################################
-def save_data_range(symbol, conn, start_date, end_date):
-    data = get_stock_data(symbol, start_date, end_date)
-    data.to_sql("stock_data", conn, if_exists="replace", index=False)
-
-
-#################################
-def save_last_trading_session(symbol, conn, today):
-    data = get_stock_data(symbol, today, today)
-    data.to_sql("stock_data", conn, if_exists="append", index=False)
-
-
-#################################
-if __name__ == "__main__":
-    conn = sqlite3.connect("market_data.sqlite")
-    if argv[1] == "bulk":
-        symbol = argv[2]
-        start_date = argv[3]
-        start_date = argv[4]
-        save_data_range(symbol, conn, start_date=None, end_date=None)
-        print(f"{symbol} saved between {start_date} and {start_date}")
-    elif argv[1] == "last":
-        symbol = argv[2]
-        calendar = argv[3]
-        cal = xcals.get_calendar(calendar)
-        today = pd.Timestamp.today().date()
-        if cal.is_session(today):
-            save_last_trading_session(symbol, conn, today)
-            print(f"{symbol} saved")
-        else:
-            print(f"{today} is not a trading day. Doing nothing.")
-    else:
-        print("Enter bulk or last")
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from sys import argv
+
+import exchange_calendars as xcals
+import pandas as pd
+
+COLUMNS = ["open", "high", "low", "close", "volume"]
+BATCH_SIZE = 5000
+MAX_WORKERS = 8
+LOOKBACK = 10  # recent sessions checked for holes by sync
+MAX_GAP = 5  # stored sessions a single sync request may span
+
+SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS stock_data (
+    symbol TEXT NOT NULL,
+    date TEXT NOT NULL,
+    {", ".join(f"{col} REAL" for col in COLUMNS)},
+    PRIMARY KEY (symbol, date)
+) WITHOUT ROWID
+"""
+
+UPSERT = f"""
+INSERT INTO stock_data (symbol, date, {", ".join(COLUMNS)})
+VALUES ({", ".join("?" * (len(COLUMNS) + 2))})
+ON CONFLICT (symbol, date) DO UPDATE SET
+{", ".join(f"{col} = excluded.{col}" for col in COLUMNS)}
+"""
+
+
+#################################
+def get_stock_data(symbol, start_date=None, end_date=None):
+    """Default provider: daily bars from yfinance through OpenBB."""
+    from openbb import obb
+
+    obb.user.preferences.output_type = "dataframe"
+    data = obb.equity.price.historical(
+        symbol,
+        start_date=start_date,
+        end_date=end_date,
+        provider="yfinance",
+    )
+    data.reset_index(inplace=True)
+    data["symbol"] = symbol
+    return data
+
+
+#################################
+def csv_provider(path):
+    """Returns a provider reading bars from a local CSV file.
+
+    The file needs the columns symbol, date and COLUMNS; it stands in for
+    get_stock_data in tests and offline runs.
+    """
+    bars = pd.read_csv(path, parse_dates=["date"])
+
+    def fetch(symbol, start_date=None, end_date=None):
+        data = bars[bars["symbol"] == symbol]
+        if start_date is not None:
+            data = data[data["date"] >= pd.Timestamp(start_date)]
+        if end_date is not None:
+            data = data[data["date"] <= pd.Timestamp(end_date)]
+        return data.reset_index(drop=True)
+
+    return fetch
+
+
+#################################
+def connect(path="market_data.sqlite"):
+    """Opens the database in WAL mode and makes sure the schema exists."""
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    init_db(conn)
+    return conn
+
+
+#################################
+def init_db(conn):
+    """Creates stock_data with a (symbol, date) primary key.
+
+    Tables written by earlier versions of this script (to_sql, no key) are
+    migrated in place, keeping the last row seen for every (symbol, date).
+    """
+    info = conn.execute("PRAGMA table_info(stock_data)").fetchall()
+    legacy = info and not any(row[5] for row in info)
+    with conn:
+        if legacy:
+            conn.execute("ALTER TABLE stock_data RENAME TO stock_data_legacy")
+        conn.execute(SCHEMA)
+        if legacy:
+            present = {row[1] for row in info}
+            cols = [col if col in present else "NULL" for col in COLUMNS]
+            conn.execute(
+                f"INSERT OR REPLACE INTO stock_data "
+                f"SELECT symbol, substr(date, 1, 10), {', '.join(cols)} "
+                f"FROM stock_data_legacy ORDER BY rowid"
+            )
+            conn.execute("DROP TABLE stock_data_legacy")
+
+
+#################################
+def to_rows(data):
+    """Converts a provider frame into (symbol, date, *COLUMNS) tuples."""
+    data = data.reindex(columns=["symbol", "date"] + COLUMNS)
+    data["date"] = pd.to_datetime(data["date"]).dt.strftime("%Y-%m-%d")
+    data = data.astype(object).where(data.notna(), None)
+    return list(data.itertuples(index=False, name=None))
+
+
+#################################
+def upsert_rows(conn, rows, batch_size=BATCH_SIZE):
+    """Writes rows with batched executemany upserts in one transaction."""
+    with conn:
+        for i in range(0, len(rows), batch_size):
+            conn.executemany(UPSERT, rows[i : i + batch_size])
+    return len(rows)
+
+
+#################################
+def fetch_many(requests, provider=get_stock_data, max_workers=MAX_WORKERS):
+    """Fetches (symbol, start_date, end_date) requests concurrently.
+
+    Returns the rows of all successful requests and the failed symbols.
+    """
+    rows, failed = [], []
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = {
+            pool.submit(provider, symbol, start_date, end_date): symbol
+            for symbol, start_date, end_date in requests
+        }
+        for future in as_completed(futures):
+            symbol = futures[future]
+            try:
+                rows.extend(to_rows(future.result()))
+            except Exception as e:
+                print(f"{symbol} failed: {e}")
+                failed.append(symbol)
+    return rows, failed
+
+
+#################################
+def save_bulk(
+    symbols, conn, start_date=None, end_date=None,
+    provider=get_stock_data, max_workers=MAX_WORKERS,
+):
+    """Fetches symbols through a bounded thread pool and upserts them."""
+    requests = [(symbol, start_date, end_date) for symbol in symbols]
+    rows, failed = fetch_many(requests, provider, max_workers)
+    return upsert_rows(conn, rows), failed
+
+
+#################################
+def stored_symbols(conn):
+    """Lists the stored symbols, skipping from one to the next through the
+    primary key (one index seek per symbol instead of a full scan)."""
+    rows = conn.execute(
+        """
+        WITH RECURSIVE symbols(symbol) AS (
+            SELECT MIN(symbol) FROM stock_data
+            UNION ALL
+            SELECT (SELECT MIN(symbol) FROM stock_data WHERE symbol > symbols.symbol)
+            FROM symbols WHERE symbol IS NOT NULL
+        )
+        SELECT symbol FROM symbols WHERE symbol IS NOT NULL
+        """
+    )
+    return [row[0] for row in rows]
+
+
+#################################
+def newest_dates(conn, symbols=None):
+    """Returns {symbol: newest stored date} (one index seek per symbol)."""
+    if symbols is None:
+        symbols = stored_symbols(conn)
+    query = "SELECT MAX(date) FROM stock_data WHERE symbol = ?"
+    return {
+        symbol: conn.execute(query, (symbol,)).fetchone()[0] for symbol in symbols
+    }
+
+
+#################################
+def coalesce(missing, sessions, max_gap=MAX_GAP):
+    """Merges missing sessions into as few (start, end) ranges as possible.
+
+    Runs of missing sessions are joined while they are separated by at most
+    max_gap stored sessions; refetching those is cheaper than another call
+    and harmless because rows are upserted.
+    """
+    position = {session: i for i, session in enumerate(sessions)}
+    ranges = []
+    for session in missing:
+        if ranges and position[session] - position[ranges[-1][1]] <= max_gap + 1:
+            ranges[-1][1] = session
+        else:
+            ranges.append([session, session])
+    return [tuple(r) for r in ranges]
+
+
+#################################
+def plan_sync(
+    conn, symbols, cal, today, start_date, lookback=LOOKBACK, max_gap=MAX_GAP
+):
+    """Lists the (symbol, start_date, end_date) requests needed to fill gaps.
+
+    A symbol is missing every session after its newest stored date, plus any
+    holes among the last lookback sessions. Symbols without stored data are
+    requested from start_date.
+    """
+    today = pd.Timestamp(today)
+    end = today if cal.is_session(today) else cal.date_to_session(today, "previous")
+    newest = newest_dates(conn, symbols)
+    known = [date for date in newest.values() if date is not None]
+    first = min([pd.Timestamp(start_date)] + [pd.Timestamp(d) for d in known])
+    if lookback:
+        first = min(first, cal.session_offset(end, 1 - lookback))
+    first = cal.date_to_session(max(first, cal.first_session), "next")
+    sessions = [s.strftime("%Y-%m-%d") for s in cal.sessions_in_range(first, end)]
+    window = sessions[-lookback:] if lookback else []
+    # one primary-key range seek per symbol
+    query = "SELECT date FROM stock_data WHERE symbol = ? AND date BETWEEN ? AND ?"
+    stored = {}
+    if window:
+        for symbol, last in newest.items():
+            if last is not None:
+                rows = conn.execute(query, (symbol, window[0], window[-1]))
+                stored[symbol] = {row[0] for row in rows}
+    start_date = pd.Timestamp(start_date).strftime("%Y-%m-%d")
+    requests = []
+    for symbol, last in newest.items():
+        if last is None:
+            missing = [s for s in sessions if s >= start_date]
+        else:
+            have = stored.get(symbol, set())
+            missing = [s for s in window if s <= last and s not in have]
+            missing += [s for s in sessions if s > last]
+        for lo, hi in coalesce(missing, sessions, max_gap):
+            requests.append((symbol, lo, hi))
+    return requests
+
+
+#################################
+def sync(
+    symbols, conn, cal, today, start_date,
+    provider=get_stock_data, max_workers=MAX_WORKERS,
+):
+    """Fetches only the missing sessions of symbols and upserts them."""
+    requests = plan_sync(conn, symbols, cal, today, start_date)
+    rows, failed = fetch_many(requests, provider, max_workers)
+    return len(requests), upsert_rows(conn, rows), failed
+
+
+#################################
+def parse_symbols(arg, conn):
+    """Accepts 'AAPL,MSFT', '@symbols.txt' (one symbol per line) or 'all'
+    (every symbol already stored in conn)."""
+    if arg == "all":
+        return stored_symbols(conn)
+    if arg.startswith("@"):
+        with open(arg[1:]) as f:
+            return [line.strip() for line in f if line.strip()]
+    return [symbol for symbol in arg.split(",") if symbol]
+
+
+#################################
+if __name__ == "__main__":
+    conn = connect("market_data.sqlite")
+    if argv[1] == "bulk":
+        symbols = parse_symbols(argv[2], conn)
+        start_date = argv[3] if len(argv) > 3 else None
+        end_date = argv[4] if len(argv) > 4 else None
+        count, failed = save_bulk(symbols, conn, start_date, end_date)
+        print(f"{count} rows for {len(symbols) - len(failed)} symbols saved "
+              f"between {start_date} and {end_date}")
+    elif argv[1] == "last":
+        symbols = parse_symbols(argv[2], conn)
+        calendar = argv[3]
+        cal = xcals.get_calendar(calendar)
+        today = pd.Timestamp.today().date()
+        if cal.is_session(today):
+            count, failed = save_bulk(symbols, conn, today, today)
+            print(f"{len(symbols) - len(failed)} symbols saved")
+        else:
+            print(f"{today} is not a trading day. Doing nothing.")
+    elif argv[1] == "sync":
+        symbols = parse_symbols(argv[2], conn)
+        cal = xcals.get_calendar(argv[3])
+        start_date = argv[4] if len(argv) > 4 else "2000-01-01"
+        today = pd.Timestamp.today().normalize()
+        calls, count, failed = sync(symbols, conn, cal, today, start_date)
+        print(f"{count} rows saved in {calls} requests, {len(failed)} failed")
+    else:
+        print("Enter bulk, last or sync")
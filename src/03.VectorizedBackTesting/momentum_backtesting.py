@@ -8,9 +8,23 @@
 # The Python Quants GmbH
 #
 # Compared to the SMAVectorBacktester class, this one introduces two important generalizations: the fixed amount to be invested at the beginning of the backtesting period and proportional transaction costs to get closer to market realities cost-wise. In particular, the addition of transaction costs is important in the context of time series momentum strategies that often lead to a large number of transactions over time.
+import os
+import sys
+
 import numpy as np
 import pandas as pd
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from eod_data import get_panel_data, get_price_data  # noqa: E402
+from indicator_cache import get_indicator  # noqa: E402
+from performance import (  # noqa: E402
+    LazyResults,
+    deduct_costs,
+    metrics,
+    report,
+    results_frame,
+)
+
 
 class MomVectorBacktester(object):
     """Class for the vectorized backtesting of
@@ -28,58 +42,66 @@ class MomVectorBacktester(object):
         amount to be invested at the beginning
     tc: float
         proportional transaction costs (e.g., 0.5% = 0.005) per trade
+    source: str
+        URL, CSV, SQLite or HDF5 file with the EOD data (see eod_data)
 
     Methods
     =======
     get_data:
         retrieves and prepares the base data set
     run_strategy:
-        runs the backtest for the momentum-based strategy
+        runs the backtest for the momentum-based strategy (metrics_only=True
+        returns the unrounded Metrics record, a vector tc one row per cost
+        level)
     plot_results:
         plots the performance of the strategy compared to the symbol
     """
 
-    def __init__(self, symbol, start, end, amount, tc):
+    results = LazyResults()
+
+    def __init__(self, symbol, start, end, amount, tc, source=None):
         self.symbol = symbol
         self.start = start
         self.end = end
         self.amount = amount
         self.tc = tc
+        self.source = source
         self.results = None
         self.get_data()
 
     def get_data(self):
         """Retrieves and prepares the data."""
-        raw = pd.read_csv(
-            "http://hilpisch.com/pyalgo_eikon_eod_data.csv",
-            index_col=0,
-            parse_dates=True,
-        ).dropna()
-        raw = pd.DataFrame(raw[self.symbol])
-        raw = raw.loc[self.start : self.end]
-        raw.rename(columns={self.symbol: "price"}, inplace=True)
+        raw = get_price_data(self.symbol, self.start, self.end, self.source)
         raw["return"] = np.log(raw / raw.shift(1))
         self.data = raw
 
-    def run_strategy(self, momentum=1):
-        """Backtests the trading strategy."""
+    def run_strategy(self, momentum=1, metrics_only=False, tc=None):
+        """Backtests the trading strategy (tc defaults to self.tc)."""
         self.momentum = momentum
-        data = self.data.copy().dropna()
-        data["position"] = np.sign(data["return"].rolling(momentum).mean())
-        data["strategy"] = data["position"].shift(1) * data["return"]
+        tc = self.tc if tc is None else tc
+        data = self.data.iloc[1:]  # the first bar has no return
+        position = np.sign(
+            get_indicator(self.symbol, "momentum", momentum, data["return"])
+        )
+        rets = data["return"].values[momentum:]
+        # the position of one bar earns the return of the next bar
+        strategy = position[momentum - 1 : -1] * rets
+        position = position[momentum:]
         # determine when a trade takes place
-        data.dropna(inplace=True)
-        trades = data["position"].diff().fillna(0) != 0
+        trades = np.zeros(len(position), dtype=bool)
+        trades[1:] = position[1:] != position[:-1]
         # subtract transaction costs from return when trade takes place
-        data["strategy"][trades] -= self.tc
-        data["creturns"] = self.amount * data["return"].cumsum().apply(np.exp)
-        data["cstrategy"] = self.amount * data["strategy"].cumsum().apply(np.exp)
-        self.results = data
-        # absolute performance of the strategy
-        aperf = self.results["cstrategy"].iloc[-1]
-        # out-/underperformance of strategy
-        operf = aperf - self.results["creturns"].iloc[-1]
-        return round(aperf, 2), round(operf, 2)
+        strategy = deduct_costs(strategy, trades, tc)
+        self.results = lambda: results_frame(
+            data.iloc[momentum:],
+            self.amount,
+            tc=tc,
+            position=position,
+            strategy=strategy,
+        )
+        # absolute performance and out-/underperformance of the strategy
+        result = metrics(rets, strategy, self.amount, position)
+        return report(result, tc, metrics_only)
 
     def plot_results(self):
         """Plots the cumulative performance of the trading strategy
@@ -89,7 +111,115 @@ class MomVectorBacktester(object):
             print("No results to plot yet. Run a strategy.")
             return
         title = "%s | TC = %.4f" % (self.symbol, self.tc)
-        self.results[["creturns", "cstrategy"]].plot(title=title, figsize=(10, 6))
+        self.results.filter(regex="^c(returns|strategy)").plot(
+            title=title, figsize=(10, 6)
+        )
+
+
+def panel_summary(symbols, returns, strategy, amount, position):
+    """Returns the unrounded Metrics per symbol of a panel as a frame.
+
+    Parameters
+    ==========
+    symbols: list
+        column names
+    returns, strategy, position: np.ndarray
+        (dates x symbols) log returns of the market and of the strategy and
+        the positions; NaN entries are skipped like in pandas' cumsum
+    """
+    result = metrics(returns, strategy, amount, position)
+    return pd.DataFrame(result._asdict(), index=pd.Index(symbols, name="symbol"))
+
+
+class MomPanelBacktester(MomVectorBacktester):
+    """Class for the vectorized backtesting of momentum-based trading
+    strategies over many symbols at once (panel mode).
+
+    Positions, transaction costs and cumulative performance of all symbols
+    are computed as (dates x symbols) array operations in one pass; the
+    results per symbol equal those of MomVectorBacktester.
+
+    Attributes
+    ==========
+    symbols: list or str
+        RICs to work with or 'all' (every symbol of the data source)
+    start: str
+        start date for data selection
+    end: str
+        end date for data selection
+    amount: int, float
+        amount to be invested at the beginning (per symbol)
+    tc: float
+        proportional transaction costs (e.g., 0.5% = 0.005) per trade
+    source: str
+        URL, CSV, SQLite or HDF5 file with the EOD data (see eod_data)
+
+    Methods
+    =======
+    get_data:
+        retrieves the (dates x symbols) price panel
+    run_strategy:
+        runs the backtest and returns the rounded aperf/operf summary per
+        symbol (all metrics, unrounded, with metrics_only=True)
+    plot_results:
+        plots the cumulative performance of the strategy per symbol
+    """
+
+    def __init__(self, symbols, start, end, amount, tc, source=None):
+        super().__init__(symbols, start, end, amount, tc, source)
+
+    def get_data(self):
+        """Retrieves the price panel and the log returns."""
+        self.data = get_panel_data(self.symbol, self.start, self.end, self.source)
+        self.symbols = list(self.data.columns)
+        prices = self.data.values
+        self.returns = np.log(prices[1:] / prices[:-1])
+
+    def _store_results(self, rows, returns, strategy, position, metrics_only):
+        self.summary = panel_summary(
+            self.symbols, returns, strategy, self.amount, position
+        )
+        index = self.data.index[1:][rows]
+
+        def frames():
+            cumulative = {
+                "creturns": np.nancumsum(returns, axis=0),
+                "cstrategy": np.nancumsum(strategy, axis=0),
+            }
+            return {
+                name: pd.DataFrame(
+                    self.amount * np.exp(values), index=index, columns=self.symbols
+                )
+                for name, values in cumulative.items()
+            }
+
+        self.results = frames
+        if metrics_only:
+            return self.summary
+        return self.summary[["aperf", "operf"]].round(2)
+
+    def run_strategy(self, momentum=1, metrics_only=False):
+        """Backtests the trading strategy for all symbols."""
+        self.momentum = momentum
+        rets = self.returns
+        position = np.sign(pd.DataFrame(rets).rolling(momentum).mean().values)
+        # the position of a bar earns the return of the next bar
+        strategy = position[momentum - 1 : -1] * rets[momentum:]
+        position = position[momentum:]
+        trades = np.zeros(position.shape, dtype=bool)
+        trades[1:] = position[1:] != position[:-1]
+        strategy = strategy - self.tc * trades
+        return self._store_results(
+            slice(momentum, None), rets[momentum:], strategy, position, metrics_only
+        )
+
+    def plot_results(self):
+        """Plots the cumulative performance of the strategy per symbol."""
+        if self.results is None:
+            print("No results to plot yet. Run a strategy.")
+            return
+        title = "Panel | TC = %.4f" % self.tc
+        self.results["cstrategy"].plot(title=title, figsize=(10, 6))
 
 
 if __name__ == "__main__":
@@ -98,3 +228,6 @@ if __name__ == "__main__":
     print(mombt.run_strategy(momentum=2))
     mombt = MomVectorBacktester("XAU=", "2010-1-1", "2020-12-31", 10000, 0.001)
     print(mombt.run_strategy(momentum=2))
+    print(mombt.run_strategy(momentum=2, tc=[0.0, 0.001, 0.002]))
+    mompbt = MomPanelBacktester("all", "2010-1-1", "2020-12-31", 10000, 0.001)
+    print(mompbt.run_strategy(momentum=2))
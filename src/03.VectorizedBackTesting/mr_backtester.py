@@ -7,8 +7,16 @@
 # (c) Dr. Yves J. Hilpisch
 # The Python Quants GmbH
 #
+import os
+import sys
+
 import numpy as np
-from momentum_backtesting import *
+import pandas as pd
+from momentum_backtesting import MomPanelBacktester, MomVectorBacktester
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from indicator_cache import get_indicator  # noqa: E402
+from performance import deduct_costs, metrics, report, results_frame  # noqa: E402
 
 
 class MRVectorBacktester(MomVectorBacktester):
@@ -27,6 +35,8 @@ class MRVectorBacktester(MomVectorBacktester):
         amount to be invested at the beginning
     tc: float
         proportional transaction costs (e.g., 0.5% = 0.005) per trade
+    source: str
+        URL, CSV, SQLite or HDF5 file with the EOD data (see eod_data)
 
     Methods
     =======
@@ -34,46 +44,114 @@ class MRVectorBacktester(MomVectorBacktester):
         retrieves and prepares the base data set
     run_strategy:
         runs the backtest for the mean reversion-based strategy
+        (metrics_only=True returns the unrounded Metrics record, a vector
+        tc one row per cost level)
     plot_results:
         plots the performance of the strategy compared to the symbol
     """
 
-    def run_strategy(self, SMA_LENGTH, threshold):
-        """Backtests the trading strategy."""
-        data = self.data.copy().dropna()
-        data["sma"] = data["price"].rolling(SMA_LENGTH).mean()
-        data["distance"] = data["price"] - data["sma"]
-        data.dropna(inplace=True)
+    def run_strategy(self, SMA_LENGTH, threshold, metrics_only=False, tc=None):
+        """Backtests the trading strategy (tc defaults to self.tc)."""
+        tc = self.tc if tc is None else tc
+        data = self.data.iloc[1:]  # the first bar has no return
+        sma = get_indicator(self.symbol, "sma", SMA_LENGTH, data["price"])
+        first = SMA_LENGTH - 1
+        data = data.iloc[first:]
+        sma = sma[first:]
+        distance = data["price"].values - sma
+        rets = data["return"].values
 
         # sell signals
-        data["position"] = np.where(data["distance"] > threshold, -1, np.nan)
+        position = np.where(distance > threshold, -1.0, np.nan)
 
         # buy signals
-        data["position"] = np.where(data["distance"] < -threshold, 1, data["position"])
+        position = np.where(distance < -threshold, 1.0, position)
 
         # crossing of current price and SMA (zero distance)
-        data["position"] = np.where(
-            data["distance"] * data["distance"].shift(1) < 0, 0, data["position"]
-        )
+        position[1:][distance[1:] * distance[:-1] < 0] = 0.0
 
-        data["position"] = data["position"].ffill().fillna(0)
-        data["strategy"] = data["position"].shift(1) * data["return"]
+        position = pd.Series(position).ffill().fillna(0).values
+        strategy = np.full(len(rets), np.nan)
+        strategy[1:] = position[:-1] * rets[1:]
 
         # determine when a trade takes place
-        trades = data["position"].diff().fillna(0) != 0
+        trades = np.zeros(len(position), dtype=bool)
+        trades[1:] = position[1:] != position[:-1]
 
         # subtract transaction costs from return when trade takes place
-        data.loc[trades, "strategy"] -= self.tc
-        data["creturns"] = self.amount * data["return"].cumsum().apply(np.exp)
-        data["cstrategy"] = self.amount * data["strategy"].cumsum().apply(np.exp)
-        self.results = data
+        strategy = deduct_costs(strategy, trades, tc)
+        self.results = lambda: results_frame(
+            data,
+            self.amount,
+            tc=tc,
+            sma=sma,
+            distance=distance,
+            position=position,
+            strategy=strategy,
+        )
+
+        # absolute performance and out-/underperformance of the strategy
+        result = metrics(rets, strategy, self.amount, position)
+        return report(result, tc, metrics_only)
+
+
+class MRPanelBacktester(MomPanelBacktester):
+    """Class for the vectorized backtesting of mean reversion-based trading
+    strategies over many symbols at once (panel mode).
+
+    The results per symbol equal those of MRVectorBacktester.
+
+    Attributes
+    ==========
+    symbols: list or str
+        RICs to work with or 'all' (every symbol of the data source)
+    start: str
+        start date for data retrieval
+    end: str
+        end date for data retrieval
+    amount: int, float
+        amount to be invested at the beginning (per symbol)
+    tc: float
+        proportional transaction costs (e.g., 0.5% = 0.005) per trade
+    source: str
+        URL, CSV, SQLite or HDF5 file with the EOD data (see eod_data)
 
-        # absolute performance of the strategy
-        aperf = self.results["cstrategy"].iloc[-1]
+    Methods
+    =======
+    get_data:
+        retrieves the (dates x symbols) price panel
+    run_strategy:
+        runs the backtest and returns the rounded aperf/operf summary per
+        symbol (all metrics, unrounded, with metrics_only=True)
+    plot_results:
+        plots the cumulative performance of the strategy per symbol
+    """
 
-        # out-/underperformance of strategy
-        operf = aperf - self.results["creturns"].iloc[-1]
-        return round(aperf, 2), round(operf, 2)
+    def run_strategy(self, SMA_LENGTH, threshold, metrics_only=False):
+        """Backtests the trading strategy for all symbols."""
+        prices = self.data.values[1:]
+        sma = pd.DataFrame(prices).rolling(SMA_LENGTH).mean().values
+        first = SMA_LENGTH - 1
+        distance = prices[first:] - sma[first:]
+        rets = self.returns[first:]
+
+        # sell signals, buy signals and crossings of price and SMA
+        position = np.where(distance > threshold, -1.0, np.nan)
+        position = np.where(distance < -threshold, 1.0, position)
+        crossing = np.zeros(distance.shape, dtype=bool)
+        crossing[1:] = distance[1:] * distance[:-1] < 0
+        position[crossing] = 0.0
+        position = pd.DataFrame(position).ffill().fillna(0).values
+
+        # the position of a bar earns the return of the next bar
+        strategy = np.full(rets.shape, np.nan)
+        strategy[1:] = position[:-1] * rets[1:]
+        trades = np.zeros(position.shape, dtype=bool)
+        trades[1:] = position[1:] != position[:-1]
+        strategy = strategy - self.tc * trades
+        return self._store_results(
+            slice(first, None), rets, strategy, position, metrics_only
+        )
 
 
 if __name__ == "__main__":
@@ -85,3 +163,6 @@ if __name__ == "__main__":
 
     mrbt = MRVectorBacktester("GLD", "2010-1-1", "2020-12-31", 10000, 0.001)
     print(mrbt.run_strategy(SMA_LENGTH=42, threshold=7.5))
+
+    mrpbt = MRPanelBacktester("all", "2010-1-1", "2020-12-31", 10000, 0.001)
+    print(mrpbt.run_strategy(SMA_LENGTH=42, threshold=7.5))
@@ -7,9 +7,79 @@
 # (c) Dr. Yves J. Hilpisch
 # The Python Quants GmbH
 #
+import os
+import sys
+
 import numpy as np
 import pandas as pd
-from scipy.optimize import brute
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from eod_data import get_price_data  # noqa: E402
+from indicator_cache import get_indicator  # noqa: E402
+from performance import LazyResults, metrics, results_frame  # noqa: E402
+
+GRID_CHUNK = 2**22  # max. number of (pair, bar) cells evaluated at once
+
+
+def sma_matrix(price, windows):
+    """Returns the SMAs of price for all windows (windows x bars).
+
+    Every window is derived from a single cumulative sum; bars before a
+    window is complete are NaN (as with rolling().mean()).
+    """
+    price = np.asarray(price, dtype=float)
+    # shifting by the first price keeps the cumulative sum small
+    csum = np.concatenate(([0.0], np.cumsum(price - price[0])))
+    smas = np.full((len(windows), len(price)), np.nan)
+    for i, window in enumerate(windows):
+        window = int(window)
+        if window <= len(price):
+            smas[i, window - 1 :] = (csum[window:] - csum[:-window]) / window
+    return smas + price[0]
+
+
+def sma_grid(price, SMA1_values, SMA2_values, chunk=GRID_CHUNK):
+    """Evaluates the SMA crossover strategy for all (SMA1, SMA2) pairs.
+
+    Equivalent to calling set_parameters and run_strategy for every pair,
+    but the positions of all pairs are compared as one 2D broadcast (in
+    chunks of SMA1 rows) and only the final cumulative sums are
+    exponentiated.
+
+    Parameters
+    ==========
+    price: array-like
+        price series
+    SMA1_values, SMA2_values: array-like
+        windows for the shorter and the longer SMA
+
+    Returns
+    =======
+    tuple
+        aperf and operf, each of shape (len(SMA1_values), len(SMA2_values));
+        NaN where the data is too short for a pair
+    """
+    price = np.asarray(price, dtype=float)
+    SMA1_values = np.asarray(SMA1_values, dtype=int)
+    SMA2_values = np.asarray(SMA2_values, dtype=int)
+    bars = len(price)
+    rets = np.zeros(bars)
+    rets[1:] = np.log(price[1:] / price[:-1])
+    sma1 = sma_matrix(price, SMA1_values)[:, 1:-1]
+    sma2 = sma_matrix(price, SMA2_values)[:, 1:-1]
+    # the position of bar t earns the return of bar t + 1; bar 0 has no
+    # return and NaN comparisons (incomplete SMAs) are False
+    long_sum = np.empty((len(SMA1_values), len(SMA2_values)))
+    step = max(1, chunk // max(1, len(SMA2_values) * bars))
+    for i in range(0, len(SMA1_values), step):
+        long_pos = sma1[i : i + step, None, :] > sma2[None, :, :]
+        long_sum[i : i + step] = long_pos @ rets[2:]
+    # strategy returns start one bar after both SMAs and the return exist
+    first = np.maximum(np.maximum.outer(SMA1_values, SMA2_values) - 1, 1) + 1
+    tail = np.concatenate((np.cumsum(rets[::-1])[::-1], [0.0]))
+    market = np.where(first < bars, tail[np.minimum(first, bars)], np.nan)
+    aperf = np.exp(2 * long_sum - market)
+    return aperf, aperf - np.exp(market)
 
 
 class SMAVectorBacktester(object):
@@ -27,6 +97,8 @@ class SMAVectorBacktester(object):
         start date for data retrieval
     end: str
         end date for data retrieval
+    source: str
+        URL, CSV, SQLite or HDF5 file with the EOD data (see eod_data)
 
     Methods
     =======
@@ -35,62 +107,71 @@ class SMAVectorBacktester(object):
     set_parameters:
         sets one or two new SMA parameters
     run_strategy:
-        runs the backtest for the SMA-based strategy
+        runs the backtest for the SMA-based strategy (metrics_only=True
+        returns the unrounded Metrics record)
     plot_results:
         plots the performance of the strategy compared to the symbol
     update_and_run:
         updates SMA parameters and returns the (negative) absolute performance
+    grid_performance:
+        returns the performance surface for all SMA parameter pairs
     optimize_parameters:
         implements a brute force optimization for the two SMA parameters
     """
 
-    def __init__(self, symbol, SMA1, SMA2, start, end):
+    results = LazyResults()
+
+    def __init__(self, symbol, SMA1, SMA2, start, end, source=None):
         self.symbol = symbol
         self.SMA1 = SMA1
         self.SMA2 = SMA2
         self.start = start
         self.end = end
+        self.source = source
         self.results = None
         self.get_data()
 
     def get_data(self):
         """Retrieves and prepares the data."""
-        raw = pd.read_csv(
-            "http://hilpisch.com/pyalgo_eikon_eod_data.csv",
-            index_col=0,
-            parse_dates=True,
-        ).dropna()
-        raw = pd.DataFrame(raw[self.symbol])
-        raw = raw.loc[self.start : self.end]
-        raw.rename(columns={self.symbol: "price"}, inplace=True)
+        raw = get_price_data(self.symbol, self.start, self.end, self.source)
         raw["return"] = np.log(raw / raw.shift(1))
-        raw["SMA1"] = raw["price"].rolling(self.SMA1).mean()
-        raw["SMA2"] = raw["price"].rolling(self.SMA2).mean()
+        raw["SMA1"] = get_indicator(self.symbol, "sma", self.SMA1, raw["price"])
+        raw["SMA2"] = get_indicator(self.symbol, "sma", self.SMA2, raw["price"])
         self.data = raw
 
     def set_parameters(self, SMA1=None, SMA2=None):
         """Updates SMA parameters and resp. time series."""
         if SMA1 is not None:
             self.SMA1 = SMA1
-            self.data["SMA1"] = self.data["price"].rolling(self.SMA1).mean()
+            self.data["SMA1"] = get_indicator(
+                self.symbol, "sma", self.SMA1, self.data["price"]
+            )
         if SMA2 is not None:
             self.SMA2 = SMA2
-            self.data["SMA2"] = self.data["price"].rolling(self.SMA2).mean()
+            self.data["SMA2"] = get_indicator(
+                self.symbol, "sma", self.SMA2, self.data["price"]
+            )
 
-    def run_strategy(self):
+    def run_strategy(self, metrics_only=False):
         """Backtests the trading strategy."""
-        data = self.data.copy().dropna()
-        data["position"] = np.where(data["SMA1"] > data["SMA2"], 1, -1)
-        data["strategy"] = data["position"].shift(1) * data["return"]
-        data.dropna(inplace=True)
-        data["creturns"] = data["return"].cumsum().apply(np.exp)
-        data["cstrategy"] = data["strategy"].cumsum().apply(np.exp)
-        self.results = data
-        # gross performance of the strategy
-        aperf = data["cstrategy"].iloc[-1]
-        # out-/underperformance of strategy
-        operf = aperf - data["creturns"].iloc[-1]
-        return round(aperf, 2), round(operf, 2)
+        data = self.data.copy(deep=False)
+        rets = data["return"].values
+        sma1, sma2 = data["SMA1"].values, data["SMA2"].values
+        rows = np.flatnonzero(~(np.isnan(rets) | np.isnan(sma1) | np.isnan(sma2)))
+        position = np.where(sma1[rows] > sma2[rows], 1, -1)
+        # the position of one row earns the return of the next row
+        strategy = position[:-1] * rets[rows[1:]]
+        self.results = lambda: results_frame(
+            data.iloc[rows[1:]],
+            1,
+            position=position[1:],
+            strategy=strategy,
+        )
+        result = metrics(rets[rows[1:]], strategy, position=position)
+        if metrics_only:
+            return result
+        # gross performance and out-/underperformance of the strategy
+        return round(result.aperf, 2), round(result.operf, 2)
 
     def plot_results(self):
         """Plots the cumulative performance of the trading strategy
@@ -113,6 +194,30 @@ class SMAVectorBacktester(object):
         self.set_parameters(int(SMA[0]), int(SMA[1]))
         return -self.run_strategy()[0]
 
+    def grid_performance(self, SMA1_range, SMA2_range):
+        """Evaluates all SMA parameter pairs with sma_grid.
+
+        Parameters
+        ==========
+        SMA1_range, SMA2_range: tuple
+            tuples of the form (start, end, step size)
+
+        Returns
+        =======
+        pd.DataFrame
+            aperf and operf indexed by (SMA1, SMA2); use unstack() for
+            the 2D surface
+        """
+        SMA1_values = np.arange(*SMA1_range).astype(int)
+        SMA2_values = np.arange(*SMA2_range).astype(int)
+        aperf, operf = sma_grid(self.data["price"].values, SMA1_values, SMA2_values)
+        index = pd.MultiIndex.from_product(
+            [SMA1_values, SMA2_values], names=["SMA1", "SMA2"]
+        )
+        return pd.DataFrame(
+            {"aperf": aperf.ravel(), "operf": operf.ravel()}, index=index
+        )
+
     def optimize_parameters(self, SMA1_range, SMA2_range):
         """Finds global maximum given the SMA parameter ranges.
 
@@ -126,7 +231,10 @@ class SMAVectorBacktester(object):
         tuple
             Optimal parameters and the negative absolute performance
         """
-        opt = brute(self.update_and_run, (SMA1_range, SMA2_range), finish=None)
+        surface = self.grid_performance(SMA1_range, SMA2_range)
+        # same tie-breaking as brute on the rounded performance
+        best = surface["aperf"].round(2).fillna(-np.inf).values.argmax()
+        opt = np.array(surface.index[best], dtype=float)
         return opt, -self.update_and_run(opt)
 
 
@@ -0,0 +1,181 @@
+#
+# Python Module for Process-Parallel
+# Parameter Sweeps of the
+# Vectorized Backtesters
+#
+# The price data of the backtester is copied once into a
+# multiprocessing.shared_memory block; every worker process attaches to it
+# and builds one backtester instance on top of it, so tasks only carry
+# parameter dicts and the data is never pickled per task.
+#
+import itertools
+import math
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import shared_memory
+
+import numpy as np
+import pandas as pd
+
+_backtester = None
+_shm = None
+
+
+def parameter_grid(grid):
+    """Expands {'name': values, ...} into a list of parameter dicts
+    (a list of dicts is returned as is)."""
+    if isinstance(grid, dict):
+        names = list(grid)
+        return [
+            dict(zip(names, values)) for values in itertools.product(*grid.values())
+        ]
+    return list(grid)
+
+
+def share_frame(data):
+    """Copies the index and the float columns of data into shared memory.
+
+    Returns the SharedMemory block and the layout needed to attach to it.
+    """
+    columns = [col for col in data.columns if data[col].dtype.kind == "f"]
+    length = len(data)
+    shm = shared_memory.SharedMemory(
+        create=True, size=max(1, 8 * length * (len(columns) + 1))
+    )
+    block = np.ndarray((len(columns) + 1, length), dtype=np.float64, buffer=shm.buf)
+    block[0].view(np.int64)[:] = data.index.values.astype("datetime64[ns]").view(
+        np.int64
+    )
+    for i, col in enumerate(columns):
+        block[i + 1] = data[col].values
+    return shm, (shm.name, columns, length, data.index.name)
+
+
+def attach_frame(name, columns, length, index_name):
+    """Attaches to a block written by share_frame and returns it together
+    with a read-only frame backed by it."""
+    shm = shared_memory.SharedMemory(name=name)
+    block = np.ndarray((len(columns) + 1, length), dtype=np.float64, buffer=shm.buf)
+    block.flags.writeable = False
+    index = pd.DatetimeIndex(block[0].view("datetime64[ns]"), name=index_name)
+    data = pd.DataFrame(
+        {col: block[i + 1] for i, col in enumerate(columns)}, index=index, copy=False
+    )
+    return shm, data
+
+
+def run_parameters(backtester, params):
+    """Runs one backtest: backtesters with set_parameters (SMA) are updated
+    first, all others receive params as run_strategy arguments."""
+    if hasattr(backtester, "set_parameters"):
+        backtester.set_parameters(**params)
+        return backtester.run_strategy()
+    return backtester.run_strategy(**params)
+
+
+def _init_worker(cls, state, layout):
+    global _backtester, _shm
+    _shm, data = attach_frame(*layout)
+    backtester = cls.__new__(cls)  # skips get_data()
+    backtester.__dict__.update(state)
+    backtester.data = data
+    _backtester = backtester
+
+
+def _run_chunk(chunk):
+    return [(params, run_parameters(_backtester, params)) for params in chunk]
+
+
+def sweep(cls, grid, *args, max_workers=None, chunksize=None, **kwargs):
+    """Runs cls(*args, **kwargs) for every parameter set of grid on a
+    process pool and yields (params, result) pairs as they finish.
+
+    Parameters
+    ==========
+    cls: type
+        backtester class, e.g. MomVectorBacktester
+    grid: dict or list
+        {'momentum': range(1, 50)} or a list of parameter dicts
+    max_workers: int
+        cap on the number of worker processes (default: CPU count)
+    chunksize: int
+        parameter sets per task (default: about four tasks per worker)
+    """
+    backtester = cls(*args, **kwargs)
+    params = parameter_grid(grid)
+    max_workers = min(max_workers or os.cpu_count() or 1, max(1, len(params)))
+    chunksize = chunksize or max(1, math.ceil(len(params) / (4 * max_workers)))
+    state = {
+        key: value
+        for key, value in vars(backtester).items()
+        if key not in ("data", "_results")
+    }
+    shm, layout = share_frame(backtester.data)
+    try:
+        with ProcessPoolExecutor(
+            max_workers, initializer=_init_worker, initargs=(cls, state, layout)
+        ) as pool:
+            futures = [
+                pool.submit(_run_chunk, params[i : i + chunksize])
+                for i in range(0, len(params), chunksize)
+            ]
+            try:
+                for future in as_completed(futures):
+                    yield from future.result()
+            finally:
+                for future in futures:
+                    future.cancel()
+    finally:
+        shm.close()
+        shm.unlink()
+
+
+def sweep_table(cls, grid, *args, **kwargs):
+    """Collects sweep into a frame with one row per parameter set."""
+    rows = [
+        dict(params, aperf=result[0], operf=result[1])
+        for params, result in sweep(cls, grid, *args, **kwargs)
+    ]
+    names = list(rows[0])[:-2] if rows else []
+    return pd.DataFrame(rows).set_index(names).sort_index()
+
+
+if __name__ == "__main__":
+    from momentum_backtesting import MomVectorBacktester
+    from mr_backtester import MRVectorBacktester
+    from sma_backtesting import SMAVectorBacktester
+
+    print(
+        sweep_table(
+            MomVectorBacktester,
+            {"momentum": range(1, 21)},
+            "XAU=",
+            "2010-1-1",
+            "2020-12-31",
+            10000,
+            0.001,
+            max_workers=4,
+        ).head()
+    )
+    print(
+        sweep_table(
+            MRVectorBacktester,
+            {"SMA_LENGTH": range(10, 60, 5), "threshold": [2.5, 5, 7.5]},
+            "GDX",
+            "2010-1-1",
+            "2020-12-31",
+            10000,
+            0.001,
+        ).head()
+    )
+    print(
+        sweep_table(
+            SMAVectorBacktester,
+            {"SMA1": range(20, 60, 4), "SMA2": range(180, 300, 10)},
+            "EUR=",
+            42,
+            252,
+            "2010-1-1",
+            "2020-12-31",
+        ).head()
+    )
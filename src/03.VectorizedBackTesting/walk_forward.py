@@ -0,0 +1,252 @@
+#
+# Python Module for Walk-Forward
+# Optimization of the
+# Vectorized Backtesters
+#
+# The indicators of every candidate parameter set are computed once over
+# the full history (through the indicator cache) and turned into a
+# (parameter sets x bars) matrix of strategy log returns. Each in-sample
+# optimization is then the difference of two columns of its cumulative
+# sum, and each out-of-sample evaluation a slice of the position matrix;
+# no window re-runs a backtest or copies data.
+#
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+from momentum_backtesting import MomPanelBacktester, MomVectorBacktester
+from mr_backtester import MRVectorBacktester
+from sma_backtesting import SMAVectorBacktester
+from sweep import parameter_grid
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from indicator_cache import get_indicator  # noqa: E402
+from walk_forward_windows import windows  # noqa: E402
+
+
+def _ffill(values):
+    """Forward-fills NaN entries of a 1D array (leading NaN are kept)."""
+    idx = np.where(np.isnan(values), 0, np.arange(len(values)))
+    np.maximum.accumulate(idx, out=idx)
+    return values[idx]
+
+
+def sma_positions(backtester, params):
+    """Positions of SMAVectorBacktester for every parameter set."""
+    data = backtester.data
+    price = data["price"]
+    windows = {int(p[name]) for p in params for name in ("SMA1", "SMA2")}
+    smas = {w: get_indicator(backtester.symbol, "sma", w, price) for w in windows}
+    pos = np.full((len(params), len(data)), np.nan)
+    has_return = ~np.isnan(data["return"].values)
+    for i, p in enumerate(params):
+        sma1, sma2 = smas[int(p["SMA1"])], smas[int(p["SMA2"])]
+        valid = has_return & ~np.isnan(sma1) & ~np.isnan(sma2)
+        pos[i, valid] = np.where(sma1[valid] > sma2[valid], 1, -1)
+    return pos
+
+
+def momentum_positions(backtester, params):
+    """Positions of MomVectorBacktester for every parameter set."""
+    data = backtester.data.dropna()
+    offset = len(backtester.data) - len(data)
+    pos = np.full((len(params), len(backtester.data)), np.nan)
+    for i, p in enumerate(params):
+        momentum = get_indicator(
+            backtester.symbol, "momentum", p["momentum"], data["return"]
+        )
+        pos[i, offset:] = np.sign(momentum)
+    return pos
+
+
+def mr_positions(backtester, params):
+    """Positions of MRVectorBacktester for every parameter set."""
+    data = backtester.data.dropna()
+    offset = len(backtester.data) - len(data)
+    price = data["price"].values
+    pos = np.full((len(params), len(backtester.data)), np.nan)
+    for i, p in enumerate(params):
+        sma = get_indicator(backtester.symbol, "sma", p["SMA_LENGTH"], data["price"])
+        valid = ~np.isnan(sma)
+        distance = price[valid] - sma[valid]
+        # sell signals, buy signals and crossings of price and SMA
+        position = np.where(distance > p["threshold"], -1.0, np.nan)
+        position = np.where(distance < -p["threshold"], 1.0, position)
+        position[1:][distance[1:] * distance[:-1] < 0] = 0.0
+        position = np.nan_to_num(_ffill(position))
+        pos[i, offset:][valid] = position
+    return pos
+
+
+def positions(backtester, params):
+    """Returns the (parameter sets x bars) position matrix of backtester.
+
+    Bars without a position (incomplete indicators) are NaN.
+    """
+    if isinstance(backtester, MomPanelBacktester):
+        raise TypeError("Walk-forward runs on single-symbol backtesters.")
+    if isinstance(backtester, SMAVectorBacktester):
+        return sma_positions(backtester, params)
+    if isinstance(backtester, MRVectorBacktester):
+        return mr_positions(backtester, params)
+    if isinstance(backtester, MomVectorBacktester):
+        return momentum_positions(backtester, params)
+    raise TypeError(f"No walk-forward kernel for {type(backtester).__name__}.")
+
+
+def cost_lead(backtester):
+    """Number of bars with a position a trade needs before it is charged
+    tc, as in the backtester's run_strategy.
+
+    MRVectorBacktester compares every position with the one before from the
+    first bar with a position on (1); MomVectorBacktester only from the
+    first bar with a strategy return on (2).
+    """
+    return 1 if isinstance(backtester, MRVectorBacktester) else 2
+
+
+def strategy_returns(pos, rets, tc=0.0, lead=2):
+    """Strategy log returns for every row of pos, as run_strategy computes
+    them: the position of bar t - 1 earns the return of bar t and tc is
+    subtracted on bars where the position changes (see cost_lead). Bars
+    without a strategy return are 0, so cumulative sums can be taken
+    directly.
+    """
+    strat = np.zeros(pos.shape)
+    strat[:, 1:] = np.nan_to_num(pos[:, :-1] * rets[1:])
+    if tc:
+        # the positions are NaN up to the end of the indicator warm-up only
+        valid = ~np.isnan(pos)
+        trades = np.zeros(pos.shape, dtype=bool)
+        trades[:, lead:] = (pos[:, lead:] != pos[:, lead - 1 : -1]) & valid[:, :-lead]
+        trades &= valid
+        strat -= tc * trades
+    return strat
+
+
+def run_params(backtester, params):
+    """Runs the backtester's run_strategy for one parameter set; returns the
+    Metrics."""
+    if isinstance(backtester, SMAVectorBacktester):
+        backtester.set_parameters(int(params["SMA1"]), int(params["SMA2"]))
+        return backtester.run_strategy(metrics_only=True)
+    return backtester.run_strategy(**params, metrics_only=True)
+
+
+def check_full_sample(backtester, grid, rtol=1e-9):
+    """Checks that the strategy returns of every parameter set, summed over
+    the full sample (a single window), reproduce the absolute performance
+    of run_strategy; raises an AssertionError otherwise."""
+    params = parameter_grid(grid)
+    amount = getattr(backtester, "amount", 1)
+    tc = getattr(backtester, "tc", 0.0)
+    strat = strategy_returns(
+        positions(backtester, params),
+        backtester.data["return"].values,
+        tc,
+        cost_lead(backtester),
+    )
+    aperf = amount * np.exp(strat.sum(axis=1))
+    expected = [run_params(backtester, p).aperf for p in params]
+    np.testing.assert_allclose(aperf, expected, rtol=rtol)
+
+
+def walk_forward(backtester, grid, train, test, anchored=False):
+    """Walk-forward optimization of a vectorized backtester.
+
+    For every window the parameter set with the highest in-sample absolute
+    performance is chosen and traded over the following test bars; the
+    out-of-sample positions are stitched into one equity curve (switching
+    parameters costs tc like any other position change).
+
+    Parameters
+    ==========
+    backtester: SMAVectorBacktester, MomVectorBacktester or MRVectorBacktester
+        backtester holding the full history
+    grid: dict or list
+        candidate parameter sets, e.g. {'momentum': range(1, 50)}
+    train, test: int
+        number of bars in the in-sample and out-of-sample windows
+    anchored: bool
+        if True, in-sample windows always start at the first bar
+
+    Returns
+    =======
+    tuple
+        out-of-sample results (return, position, strategy, creturns,
+        cstrategy) and a frame with the dates, chosen parameters and
+        in-/out-of-sample absolute performance per window
+    """
+    params = parameter_grid(grid)
+    amount = getattr(backtester, "amount", 1)
+    tc = getattr(backtester, "tc", 0.0)
+    rets = backtester.data["return"].values
+    index = backtester.data.index
+    pos = positions(backtester, params)
+    csum = np.zeros((len(params), len(index) + 1))
+    np.cumsum(
+        strategy_returns(pos, rets, tc, cost_lead(backtester)),
+        axis=1,
+        out=csum[:, 1:],
+    )
+    spans = windows(len(index), train, test, anchored)
+    if not spans:
+        raise ValueError(f"{len(index)} bars leave no out-of-sample window.")
+    # in-sample performance of every parameter set (rows) per window
+    train_starts, test_starts, _ = np.array(spans).T
+    best = np.argmax(csum[:, test_starts] - csum[:, train_starts], axis=0)
+
+    # the position set at the close of the last in-sample bar already
+    # uses the parameters chosen on that window
+    first = spans[0][1] - 1
+    held = np.empty(len(index) - first)
+    for (_, test_start, test_end), row in zip(spans, best):
+        held[test_start - 1 - first : test_end - first] = pos[
+            row, test_start - 1 : test_end
+        ]
+    held = np.nan_to_num(held)
+    oos = pd.DataFrame({"return": rets[first + 1 :]}, index=index[first + 1 :])
+    oos["position"] = held[1:]
+    oos["strategy"] = held[:-1] * oos["return"].values
+    oos.loc[held[1:] != held[:-1], "strategy"] -= tc
+    oos["creturns"] = amount * np.exp(oos["return"].cumsum())
+    oos["cstrategy"] = amount * np.exp(oos["strategy"].cumsum())
+
+    ostrat = np.concatenate(([0.0], oos["strategy"].cumsum().values))
+    rows = []
+    for (train_start, test_start, test_end), row in zip(spans, best):
+        is_perf = csum[row, test_start] - csum[row, train_start]
+        oos_perf = ostrat[test_end - first - 1] - ostrat[test_start - first - 1]
+        rows.append(
+            dict(
+                train_start=index[train_start],
+                train_end=index[test_start - 1],
+                test_start=index[test_start],
+                test_end=index[test_end - 1],
+                **params[row],
+                is_aperf=amount * np.exp(is_perf),
+                oos_aperf=amount * np.exp(oos_perf),
+            )
+        )
+    return oos, pd.DataFrame(rows)
+
+
+if __name__ == "__main__":
+    smabt = SMAVectorBacktester("EUR=", 42, 252, "2010-1-1", "2020-12-31")
+    oos, chosen = walk_forward(
+        smabt, {"SMA1": range(20, 61, 4), "SMA2": range(180, 281, 10)}, 756, 252
+    )
+    print(chosen)
+    print(oos[["creturns", "cstrategy"]].iloc[-1])
+
+    mombt = MomVectorBacktester("XAU=", "2010-1-1", "2020-12-31", 10000, 0.001)
+    check_full_sample(mombt, {"momentum": range(1, 21)})
+    oos, chosen = walk_forward(mombt, {"momentum": range(1, 21)}, 504, 126)
+    print(chosen)
+
+    mrbt = MRVectorBacktester("GDX", "2010-1-1", "2020-12-31", 10000, 0.001)
+    mr_grid = {"SMA_LENGTH": range(10, 60, 5), "threshold": [2.5, 5, 7.5]}
+    check_full_sample(mrbt, mr_grid)
+    oos, chosen = walk_forward(mrbt, mr_grid, 504, 126)
+    print(chosen)
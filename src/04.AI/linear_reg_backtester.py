@@ -7,9 +7,32 @@
 # (c) Dr. Yves J. Hilpisch
 # The Python Quants GmbH
 #
+import os
+import sys
+
 import numpy as np
 import pandas as pd
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from eod_data import get_price_data  # noqa: E402
+from feature_store import FeatureMatrix, update_features  # noqa: E402
+from lag_matrix import LagMatrix, row_bounds  # noqa: E402
+from model_cache import cached_fit, fingerprint  # noqa: E402
+from normal_equations import gram, rolling_gram, solve  # noqa: E402
+from performance import (LazyResults, deduct_costs, metrics,  # noqa: E402
+                         report, results_frame)
+
+
+def strategy_returns(prediction, rets, tc):
+    ''' Strategy log returns of the predictions net of transaction costs.
+    '''
+    strategy = prediction * rets
+    # determine when a trade takes place
+    trades = np.zeros(len(prediction), dtype=bool)
+    trades[1:] = prediction[1:] != prediction[:-1]
+    # subtract transaction costs from return when trade takes place
+    return deduct_costs(strategy, trades, tc)
+
 
 class LRVectorBacktester(object):
     ''' Class for the vectorized backtesting of
@@ -27,6 +50,10 @@ class LRVectorBacktester(object):
         amount to be invested at the beginning
     tc: float
         proportional transaction costs (e.g., 0.5% = 0.005) per trade
+    source: str
+        URL, CSV, SQLite or HDF5 file with the EOD data (see eod_data)
+    cache: bool
+        load fitted coefficients from the on-disk model cache (model_cache)
 
     Methods
     =======
@@ -34,34 +61,56 @@ class LRVectorBacktester(object):
         retrieves and prepares the base data set
     select_data:
         selects a sub-set of the data
+    feature_matrix:
+        returns stored feature columns aligned with the data (feature_store)
     prepare_lags:
-        prepares the lagged data for the regression
+        selects the lagged returns (or features) and targets for the
+        regression (views)
     fit_model:
         implements the regression step
+    rolling_fit:
+        refits the regression for every bar on a trailing window
     run_strategy:
-        runs the backtest for the regression-based strategy
+        runs the backtest for the regression-based strategy (metrics_only=True
+        returns the unrounded Metrics record, a vector tc one row per cost
+        level; refit=True refits the model before every out-of-sample bar,
+        features=[...] regresses on stored feature columns instead of lags)
+    sweep_lags:
+        fits and backtests the models with 1 to max_lags lags at once
     plot_results:
         plots the performance of the strategy compared to the symbol
     '''
-    def __init__(self, symbol, start, end, amount, tc):
+    results = LazyResults()
+
+    def __init__(self, symbol, start, end, amount, tc, source=None,
+                 cache=True):
         self.symbol = symbol
         self.start = start
         self.end = end
         self.amount = amount
         self.tc = tc
+        self.source = source
+        self.cache = cache
+        self.feature_names = None
         self.results = None
         self.get_data()
 
     def get_data(self):
         ''' Retrieves and prepares the data.
         '''
-        raw = pd.read_csv('http://hilpisch.com/pyalgo_eikon_eod_data.csv',
-                         index_col=0, parse_dates=True).dropna()
-        raw = pd.DataFrame(raw[self.symbol])
-        raw = raw.loc[self.start:self.end]
-        raw.rename(columns={self.symbol: 'price'}, inplace=True)
+        raw = get_price_data(self.symbol, self.start, self.end, self.source)
         raw['returns'] = np.log(raw / raw.shift(1))
         self.data = raw.dropna()
+        self.lag_matrix = LagMatrix(self.data['returns'].values)
+        self.design = self.lag_matrix
+
+    def feature_matrix(self, columns):
+        ''' Returns the stored feature columns (see feature_store) for the
+        rows of the data, building or extending the store if needed.
+        '''
+        store = update_features(self.symbol, self.source)
+        return FeatureMatrix(store, self.symbol, columns, self.data.index,
+                             self.data['returns'].values)
 
     def select_data(self, start, end):
         ''' Selects sub-sets of the financial data.
@@ -72,49 +121,128 @@ class LRVectorBacktester(object):
 
     def prepare_lags(self, start, end):
         ''' Prepares the lagged data for the regression and prediction steps.
+
+        Selects the rows of the full-history lag matrix (no copies); the
+        first lags bars of the period only serve as lags. With stored
+        features, rows without complete features are skipped.
         '''
-        data = self.select_data(start, end)
-        self.cols = []
-        for lag in range(1, self.lags + 1):
-            col = f'lag_{lag}'
-            data[col] = data['returns'].shift(lag)
-            self.cols.append(col)
-        data.dropna(inplace=True)
-        self.lagged_data = data
+        i, j = row_bounds(self.data.index, start, end)
+        self.features, self.target = self.design.window(i, j, self.lags)
+        self.rows = slice(j - len(self.target), j)
+        self.cols = self.feature_names or [f'lag_{lag}'
+                                           for lag in range(1, self.lags + 1)]
 
     def fit_model(self, start, end):
         ''' Implements the regression step.
         '''
         self.prepare_lags(start, end)
-        reg = np.linalg.lstsq(self.lagged_data[self.cols],
-                             np.sign(self.lagged_data['returns']),
-                             rcond=None)[0]
-        self.reg = reg
 
-    def run_strategy(self, start_in, end_in, start_out, end_out, lags=3):
-        ''' Backtests the trading strategy.
+        def fit():
+            return np.linalg.lstsq(self.features, np.sign(self.target),
+                                   rcond=None)[0]
+
+        if not self.cache or not len(self.target):
+            self.reg = fit()
+            return
+        self.reg = cached_fit(
+            self.symbol, self.data.index[self.rows.start],
+            self.data.index[self.rows.stop - 1], self.lags, 'lstsq',
+            {'columns': self.cols}, fingerprint(self.features, self.target),
+            fit)
+
+    def rolling_fit(self, window, forgetting=1.0):
+        ''' Refits the regression for every bar of the prepared period on
+        the window bars before it (one coefficient row per bar).
+
+        X'X and X'y are updated as bars enter and leave the window; with
+        forgetting < 1 every older bar is down-weighted by that factor.
+        '''
+        features = self.design.matrix(self.lags)
+        target = np.sign(self.design.returns)
+        xx, xy, counts = rolling_gram(features, target, self.rows, window,
+                                      first=self.design.first_row(self.lags),
+                                      forgetting=forgetting)
+        self.reg = solve(xx, xy, counts)
+
+    def run_strategy(self, start_in, end_in, start_out, end_out, lags=3,
+                     metrics_only=False, tc=None, refit=False,
+                     forgetting=1.0, features=None):
+        ''' Backtests the trading strategy (tc defaults to self.tc).
+
+        With refit=True the model is refit before every out-of-sample bar
+        on a rolling window as long as the in-sample period (exponentially
+        weighted for forgetting < 1) instead of once on the in-sample data.
+        features is a list of feature store columns (e.g. ['lag_1',
+        'momentum_5', 'volatility_20']) to use instead of lags lags.
         '''
+        tc = self.tc if tc is None else tc
         self.lags = lags
-        self.fit_model(start_in, end_in)
-        self.results = self.select_data(start_out, end_out).iloc[lags:]
-        self.prepare_lags(start_out, end_out)
-        prediction = np.sign(np.dot(self.lagged_data[self.cols], self.reg))
-        self.results['prediction'] = prediction
-        self.results['strategy'] = (self.results['prediction'] *
-                                  self.results['returns'])
-        # determine when a trade takes place
-        trades = self.results['prediction'].diff().fillna(0) != 0
-        # subtract transaction costs from return when trade takes place
-        self.results.loc[trades, 'strategy'] -= self.tc
-        self.results['creturns'] = (self.amount *
-                                   self.results['returns'].cumsum().apply(np.exp))
-        self.results['cstrategy'] = (self.amount *
-                                    self.results['strategy'].cumsum().apply(np.exp))
-        # gross performance of the strategy
-        aperf = self.results['cstrategy'].iloc[-1]
-        # out-/underperformance of strategy
-        operf = aperf - self.results['creturns'].iloc[-1]
-        return round(aperf, 2), round(operf, 2)
+        self.feature_names = None if features is None else list(features)
+        self.design = (self.lag_matrix if features is None
+                       else self.feature_matrix(features))
+        if refit:
+            self.prepare_lags(start_in, end_in)
+            window = len(self.target)
+            self.prepare_lags(start_out, end_out)
+            self.rolling_fit(window, forgetting)
+            prediction = np.sign((self.features * self.reg).sum(axis=1))
+        else:
+            self.fit_model(start_in, end_in)
+            self.prepare_lags(start_out, end_out)
+            prediction = np.sign(np.dot(self.features, self.reg))
+        data = self.data.iloc[self.rows]
+        rets = self.target
+        strategy = strategy_returns(prediction, rets, tc)
+        self.results = lambda: results_frame(
+            data, self.amount, market='returns', tc=tc,
+            prediction=prediction, strategy=strategy)
+        # gross performance and out-/underperformance of the strategy
+        result = metrics(rets, strategy, self.amount, prediction)
+        return report(result, tc, metrics_only)
+
+    def sweep_lags(self, start_in, end_in, start_out, end_out, max_lags=10,
+                   tc=None):
+        ''' Fits and backtests the models with 1 to max_lags lags at once.
+
+        The regressions are nested: the normal equations of k lags are the
+        leading k x k block of the Gram matrix of the widest lag matrix,
+        plus the few first bars that only the models with fewer lags keep.
+        The Gram matrix is built once and every model gives the same
+        results as run_strategy with lags=k.
+
+        Returns
+        =======
+        pd.DataFrame
+            in-sample (is_) and out-of-sample (oos_) Metrics, one row per
+            number of lags
+        '''
+        tc = self.tc if tc is None else tc
+        features = self.lag_matrix.matrix(max_lags)
+        target = np.sign(self.lag_matrix.returns)
+        periods = {'is': row_bounds(self.data.index, start_in, end_in),
+                   'oos': row_bounds(self.data.index, start_out, end_out)}
+        i, j = periods['is']
+        first = min(i + max_lags, j)
+        xx, xy = gram(features[first:j], target[first:j])
+        rows = []
+        for lags in range(max_lags, 0, -1):
+            # bar i + lags is the first one of the model with lags lags
+            t = i + lags
+            if t < first:
+                x = features[t, :lags]
+                xx[:lags, :lags] += np.outer(x, x)
+                xy[:lags] += x * target[t]
+            reg = solve(xx[:lags, :lags], xy[:lags])
+            row = {'lags': lags}
+            for label, (start, end) in periods.items():
+                x, rets = self.lag_matrix.window(start, end, lags)
+                prediction = np.sign(np.dot(x, reg))
+                strategy = strategy_returns(prediction, rets, tc)
+                result = metrics(rets, strategy, self.amount, prediction)
+                row.update({f'{label}_{name}': value
+                            for name, value in result._asdict().items()})
+            rows.append(row)
+        return pd.DataFrame(rows[::-1]).set_index('lags')
 
     def plot_results(self):
         ''' Plots the cumulative performance of the trading strategy
@@ -124,8 +252,8 @@ class LRVectorBacktester(object):
             print('No results to plot yet. Run a strategy.')
             return
         title = '%s | TC = %.4f' % (self.symbol, self.tc)
-        self.results[['creturns', 'cstrategy']].plot(title=title,
-                                                    figsize=(10, 6))
+        self.results.filter(regex='^c(returns|strategy)').plot(
+            title=title, figsize=(10, 6))
 
 
 if __name__ == '__main__':
@@ -135,3 +263,10 @@ if __name__ == '__main__':
     lrbt = LRVectorBacktester('GDX', '2010-1-1', '2019-12-31', 10000, 0.001)
     print(lrbt.run_strategy('2010-1-1', '2019-12-31','2010-1-1', '2019-12-31', lags=5))
     print(lrbt.run_strategy('2010-1-1', '2016-12-31','2017-1-1', '2019-12-31', lags=5))
+    print(lrbt.run_strategy('2016-1-1', '2016-12-31', '2017-1-1', '2019-12-31',
+                            lags=5, refit=True))
+    print(lrbt.run_strategy('2016-1-1', '2016-12-31', '2017-1-1', '2019-12-31',
+                            lags=5, refit=True, forgetting=0.99))
+    sweep = lrbt.sweep_lags('2010-1-1', '2016-12-31', '2017-1-1', '2019-12-31',
+                            max_lags=10)
+    print(sweep[['is_aperf', 'oos_aperf', 'oos_sharpe']])
@@ -7,11 +7,178 @@
 # (c) Dr. Yves J. Hilpisch
 # The Python Quants GmbH
 #
+import os
+import sys
+import time
+
 import numpy as np
 import pandas as pd
+import sklearn
+from joblib import Parallel, delayed
+from linear_reg_backtester import strategy_returns
 from sklearn import linear_model
+from sklearn.base import BaseEstimator, ClassifierMixin, clone
 from sklearn.multiclass import OneVsRestClassifier
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from eod_data import get_price_data  # noqa: E402
+from feature_store import FeatureMatrix, update_features  # noqa: E402
+from lag_matrix import LagMatrix, row_bounds  # noqa: E402
+from model_cache import cached_fit, fingerprint  # noqa: E402
+from performance import (LazyResults, metrics, report,  # noqa: E402
+                         results_frame)
+from walk_forward_windows import windows  # noqa: E402
+
+
+class WarmOneVsRest(BaseEstimator, ClassifierMixin):
+    '''One-vs-rest classifier that keeps its per-class estimators between
+    fits, so that with warm_start every fit starts from the coefficients of
+    the previous one (OneVsRestClassifier clones them on every fit).
+
+    Fits and predicts as OneVsRestClassifier: one estimator for two
+    classes, one per class otherwise (e.g. the 0 of flat days in
+    np.sign(returns)), the class with the highest decision function wins.
+    '''
+
+    def __init__(self, estimator, warm_start=False):
+        self.estimator = estimator
+        self.warm_start = warm_start
+
+    def fit(self, X, y):
+        previous = self.__dict__.get('estimators_', {})
+        if not self.warm_start:
+            previous = {}
+        self.classes_ = np.unique(y)
+        # two classes: a single estimator for the second one
+        labels = (self.classes_[1:] if len(self.classes_) == 2
+                  else self.classes_)
+        self.estimators_ = {}
+        for label in labels:
+            estimator = previous.get(label)
+            if estimator is None:
+                estimator = clone(self.estimator)
+                if 'warm_start' in estimator.get_params():
+                    estimator.set_params(warm_start=self.warm_start)
+            self.estimators_[label] = estimator.fit(
+                X, (y == label).astype(int))
+        self.n_iter_ = np.concatenate([np.ravel(getattr(e, 'n_iter_', 0))
+                                       for e in self.estimators_.values()])
+        return self
+
+    def predict(self, X):
+        scores = np.column_stack([e.decision_function(X)
+                                  for e in self.estimators_.values()])
+        if len(self.classes_) == 2:
+            return self.classes_[(scores[:, 0] > 0).astype(int)]
+        return self.classes_[np.argmax(scores, axis=1)]
+
+
+def fit_windows(model, features, target, spans, warm_start=False):
+    '''Fits a clone of model on the train rows of consecutive windows and
+    predicts their test rows.
+
+    With warm_start every fit starts from the coefficients of the previous
+    window (for models with a warm_start parameter); the solver then stops
+    at a slightly different point than a full refit, so some predictions
+    differ. Returns the
+    predictions, fit times (seconds) and solver iterations per window.'''
+    model = clone(model)
+    if warm_start and 'warm_start' in model.get_params():
+        model.set_params(warm_start=True)
+    predictions, fit_times, iterations = [], [], []
+    for train_start, test_start, test_end in spans:
+        t0 = time.perf_counter()
+        model.fit(features[train_start:test_start],
+                  np.sign(target[train_start:test_start]))
+        fit_times.append(time.perf_counter() - t0)
+        iterations.append(int(np.max(getattr(model, 'n_iter_', 0))))
+        predictions.append(model.predict(features[test_start:test_end]))
+    return predictions, fit_times, iterations
+
+
+def walk_forward(backtesters, train, test, lags=3, anchored=False,
+                 warm_start=False, max_workers=None):
+    '''Walk-forward backtest of one or more ScikitVectorBacktester objects.
+
+    The model is refit on every train window and trades the following test
+    bars. Consecutive windows form chains (optionally warm-started from the
+    previous fit); the chains of all backtesters run on a joblib process
+    pool.
+
+    Parameters
+    ==========
+    backtesters: list
+        ScikitVectorBacktester objects (e.g. one per symbol)
+    train, test: int
+        number of bars in the in-sample and out-of-sample windows
+    lags: int
+        number of lagged returns used as features
+    anchored: bool
+        if True, train windows always start at the first bar
+    warm_start: bool
+        start every fit from the coefficients of the previous window; saves
+        solver iterations, but the results are not identical to full
+        refits (the solver stops within its tolerance of the optimum, at a
+        point that depends on where it started)
+    max_workers: int
+        maximum number of worker processes (default: serial); the windows
+        of every backtester are split into max_workers // len(backtesters)
+        chains, each starting cold
+
+    Returns
+    =======
+    list
+        per backtester, the out-of-sample results (returns, prediction,
+        strategy, creturns, cstrategy) and a frame with the dates, fit
+        time, solver iterations and absolute performance per window
+    '''
+    chains = max(1, (max_workers or 1) // len(backtesters))
+    tasks = []
+    for number, backtester in enumerate(backtesters):
+        target = backtester.lag_matrix.returns
+        spans = windows(len(target), train, test, anchored, first=lags)
+        if not spans:
+            raise ValueError(f'{len(target)} bars of {backtester.symbol} '
+                             'leave no out-of-sample window.')
+        for chain in np.array_split(np.array(spans), min(chains, len(spans))):
+            # ship only the rows the chain uses to the worker
+            lo, hi = chain[:, 0].min(), chain[-1, 2]
+            tasks.append((number, chain, delayed(fit_windows)(
+                backtester.walk_forward_model,
+                backtester.lag_matrix.matrix(lags)[lo:hi], target[lo:hi],
+                chain - lo, warm_start)))
+    fitted = Parallel(n_jobs=max_workers or 1)(task for _, _, task in tasks)
+    results = []
+    for number, backtester in enumerate(backtesters):
+        spans, predictions, fit_times, iterations = [], [], [], []
+        for (owner, chain, _), fit in zip(tasks, fitted):
+            if owner == number:
+                spans.extend(chain.tolist())
+                predictions.extend(fit[0])
+                fit_times.extend(fit[1])
+                iterations.extend(fit[2])
+        rows = slice(spans[0][1], spans[-1][2])
+        prediction = np.concatenate(predictions)
+        rets = backtester.lag_matrix.returns[rows]
+        strategy = strategy_returns(prediction, rets, backtester.tc)
+        oos = results_frame(backtester.data.iloc[rows][['returns']],
+                            backtester.amount, market='returns',
+                            prediction=prediction, strategy=strategy)
+        index = backtester.data.index
+        perf = np.concatenate(([0.0], np.cumsum(strategy)))
+        per_window = pd.DataFrame({
+            'train_start': [index[s[0]] for s in spans],
+            'train_end': [index[s[1] - 1] for s in spans],
+            'test_start': [index[s[1]] for s in spans],
+            'test_end': [index[s[2] - 1] for s in spans],
+            'fit_time': fit_times,
+            'n_iter': iterations,
+            'oos_aperf': [backtester.amount * np.exp(
+                perf[s[2] - rows.start] - perf[s[1] - rows.start])
+                for s in spans]})
+        results.append((oos, per_window))
+    return results
+
 
 class ScikitVectorBacktester(object):
     '''Class for the vectorized backtesting of
@@ -31,6 +198,10 @@ class ScikitVectorBacktester(object):
         proportional transaction costs (e.g., 0.5% = 0.005) per trade
     model: str
         either 'regression' or 'logistic'
+    source: str
+        URL, CSV, SQLite or HDF5 file with the EOD data (see eod_data)
+    cache: bool
+        load fitted models from the on-disk model cache (model_cache)
 
     Methods
     =======
@@ -38,24 +209,38 @@ class ScikitVectorBacktester(object):
         retrieves and prepares the base data set
     select_data:
         selects a sub-set of the data
+    feature_matrix:
+        returns stored feature columns aligned with the data (feature_store)
     prepare_features:
-        prepares the features data for the model fitting
+        selects the lagged returns (or features) and targets for the model
+        fitting (views)
     fit_model:
         implements the fitting step
     run_strategy:
-        runs the backtest for the regression-based strategy
+        runs the backtest for the regression-based strategy (metrics_only=True
+        returns the unrounded Metrics record, a vector tc one row per cost
+        level; features=[...] fits on stored feature columns instead of lags)
+    walk_forward:
+        refits the model on rolling windows (warm-started, in parallel)
     plot_results:
         plots the performance of the strategy compared to the symbol
     '''
-    def __init__(self, symbol, start, end, amount, tc, model):
+    results = LazyResults()
+
+    def __init__(self, symbol, start, end, amount, tc, model, source=None,
+                 cache=True):
         self.symbol = symbol
         self.start = start
         self.end = end
         self.amount = amount
         self.tc = tc
+        self.source = source
+        self.cache = cache
+        self.feature_names = None
         self.results = None
         if model == 'regression':
             self.model = linear_model.LinearRegression()
+            self.walk_forward_model = self.model
         elif model == 'logistic':
             base_model = linear_model.LogisticRegression(
                 C=1e6,
@@ -63,22 +248,27 @@ class ScikitVectorBacktester(object):
                 max_iter=1000
             )
             self.model = OneVsRestClassifier(base_model)
+            # OneVsRestClassifier clones its estimator on every fit and so
+            # cannot warm-start; WarmOneVsRest fits the same model
+            self.walk_forward_model = WarmOneVsRest(base_model)
         else:
             raise ValueError('Model not known or not yet implemented.')
         self.get_data()
 
     def get_data(self):
         '''Retrieves and prepares the data.'''
-        raw = pd.read_csv(
-            'http://hilpisch.com/pyalgo_eikon_eod_data.csv',
-            index_col=0,
-            parse_dates=True
-        ).dropna()
-        raw = pd.DataFrame(raw[self.symbol])
-        raw = raw.loc[self.start:self.end]
-        raw.rename(columns={self.symbol: 'price'}, inplace=True)
+        raw = get_price_data(self.symbol, self.start, self.end, self.source)
         raw['returns'] = np.log(raw / raw.shift(1))
         self.data = raw.dropna()
+        self.lag_matrix = LagMatrix(self.data['returns'].values)
+        self.design = self.lag_matrix
+
+    def feature_matrix(self, columns):
+        '''Returns the stored feature columns (see feature_store) for the
+        rows of the data, building or extending the store if needed.'''
+        store = update_features(self.symbol, self.source)
+        return FeatureMatrix(store, self.symbol, columns, self.data.index,
+                             self.data['returns'].values)
 
     def select_data(self, start, end):
         '''Selects sub-sets of the financial data.'''
@@ -89,49 +279,66 @@ class ScikitVectorBacktester(object):
         return data
 
     def prepare_features(self, start, end):
-        '''Prepares the feature columns for the regression and prediction steps.'''
-        self.data_subset = self.select_data(start, end)
-        self.feature_columns = []
-        for lag in range(1, self.lags + 1):
-            col = f'lag_{lag}'
-            self.data_subset[col] = self.data_subset['returns'].shift(lag)
-            self.feature_columns.append(col)
-        self.data_subset.dropna(inplace=True)
+        '''Selects the features and targets for the regression and
+        prediction steps as rows of the full-history lag matrix (no copies);
+        with stored features, rows without complete features are skipped.'''
+        i, j = row_bounds(self.data.index, start, end)
+        self.features, self.target = self.design.window(i, j, self.lags)
+        self.rows = slice(j - len(self.target), j)
+        self.feature_columns = self.feature_names or [
+            f'lag_{lag}' for lag in range(1, self.lags + 1)]
 
     def fit_model(self, start, end):
         '''Implements the fitting step.'''
         self.prepare_features(start, end)
-        self.model.fit(
-            self.data_subset[self.feature_columns],
-            np.sign(self.data_subset['returns'])
-        )
 
-    def run_strategy(self, start_in, end_in, start_out, end_out, lags=3):
-        '''Backtests the trading strategy.'''
+        def fit():
+            return self.model.fit(self.features, np.sign(self.target))
+
+        if not self.cache or not len(self.target):
+            fit()
+            return
+        params = dict(self.model.get_params(deep=True),
+                      columns=self.feature_columns,
+                      sklearn=sklearn.__version__)
+        self.model = cached_fit(
+            self.symbol, self.data.index[self.rows.start],
+            self.data.index[self.rows.stop - 1], self.lags,
+            type(self.model).__name__, params,
+            fingerprint(self.features, self.target), fit)
+
+    def run_strategy(self, start_in, end_in, start_out, end_out, lags=3,
+                     metrics_only=False, tc=None, features=None):
+        '''Backtests the trading strategy (tc defaults to self.tc).
+
+        features is a list of feature store columns (e.g. ['lag_1',
+        'momentum_5', 'volatility_20']) to use instead of lags lags.'''
+        tc = self.tc if tc is None else tc
         self.lags = lags
+        self.feature_names = None if features is None else list(features)
+        self.design = (self.lag_matrix if features is None
+                       else self.feature_matrix(features))
         self.fit_model(start_in, end_in)
         self.prepare_features(start_out, end_out)
-        prediction = self.model.predict(self.data_subset[self.feature_columns])
-        self.data_subset['prediction'] = prediction
-        self.data_subset['strategy'] = (
-            self.data_subset['prediction'] * self.data_subset['returns']
-        )
-        # determine when a trade takes place
-        trades = self.data_subset['prediction'].diff().fillna(0) != 0
-        # subtract transaction costs from return when trade takes place
-        self.data_subset.loc[trades, 'strategy'] -= self.tc
-        self.data_subset['creturns'] = (
-            self.amount * self.data_subset['returns'].cumsum().apply(np.exp)
+        data = self.data.iloc[self.rows]
+        features = dict(zip(self.feature_columns, self.features.T))
+        prediction = self.model.predict(self.features)
+        rets = self.target
+        strategy = strategy_returns(prediction, rets, tc)
+        self.results = lambda: results_frame(
+            data, self.amount, market='returns', tc=tc, **features,
+            prediction=prediction, strategy=strategy
         )
-        self.data_subset['cstrategy'] = (
-            self.amount * self.data_subset['strategy'].cumsum().apply(np.exp)
-        )
-        self.results = self.data_subset
-        # absolute performance of the strategy
-        aperf = self.results['cstrategy'].iloc[-1]
-        # out-/underperformance of strategy
-        operf = aperf - self.results['creturns'].iloc[-1]
-        return round(aperf, 2), round(operf, 2)
+        # absolute performance and out-/underperformance of the strategy
+        result = metrics(rets, strategy, self.amount, prediction)
+        return report(result, tc, metrics_only)
+
+    def walk_forward(self, train, test, lags=3, anchored=False,
+                     warm_start=False, max_workers=None):
+        '''Walk-forward backtest with a refit every test bars (see the
+        module function walk_forward).'''
+        return walk_forward([self], train, test, lags, anchored, warm_start,
+                            max_workers)[0]
 
     def plot_results(self):
         '''Plots the cumulative performance of the trading strategy
@@ -140,7 +347,7 @@ class ScikitVectorBacktester(object):
             print('No results to plot yet. Run a strategy.')
             return
         title = f'{self.symbol} | TC = {self.tc:.4f}'
-        self.results[['creturns', 'cstrategy']].plot(title=title)
+        self.results.filter(regex='^c(returns|strategy)').plot(title=title)
 
 
 if __name__ == '__main__':
@@ -183,4 +390,8 @@ if __name__ == '__main__':
         '2010-1-1', '2013-12-31',
         '2014-1-1', '2019-12-31',
         lags=15
-    ))
\ No newline at end of file
+    ))
+
+    oos, per_window = scibt.walk_forward(252, 63, lags=15, max_workers=4)
+    print(per_window)
+    print(oos[['creturns', 'cstrategy']].iloc[-1])
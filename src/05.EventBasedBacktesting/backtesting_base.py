@@ -1,15 +1,51 @@
-"""Base class for event-based backtesting."""
+"""Base class for event-based backtesting.
+
+The strategy loops run on plain Python lists of the prices and
+indicators (pulled from the frame once per run) and on an Account with
+__slots__, so a bar costs a few list lookups instead of pandas indexing
+calls. The loops mark the cash and units of every bar in preallocated
+NumPy buffers, from which the net wealth and the risk statistics are
+computed in one vectorized pass when the position is closed out. Every
+fill is recorded in a columnar TradeLedger; the strategy
+header, the fills and the closing summary are passed to sinks (a
+PrintSink if verbose), so a silent run prints nothing and formats no
+dates.
+"""
+
+import os
+import sys
 
 import matplotlib as mpl
 import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from eod_data import get_price_data  # noqa: E402
+from indicator_cache import get_indicator  # noqa: E402
+from performance import metrics  # noqa: E402
+from trade_ledger import BUY, SELL, PrintSink, TradeLedger  # noqa: E402
+
 # Configuração do estilo e fonte
 plt.style.use('seaborn-v0_8')  # Versão mais recente do estilo seaborn
 mpl.rcParams['font.family'] = 'serif'
 
 
+class Account:
+    """State of a strategy run: cash, units held, position and trades."""
+
+    __slots__ = ('amount', 'units', 'position', 'trades')
+
+    def __init__(self, amount):
+        self.amount = amount
+        self.units = 0
+        self.position = 0
+        self.trades = 0
+
+
+_PRINT = PrintSink()
+
+
 class BacktestBase:
     """Base class for event-based backtesting of trading strategies.
 
@@ -27,6 +63,17 @@ class BacktestBase:
         fixed transaction costs per trade (buy or sell)
     ptc : float
         proportional transaction costs per trade (buy or sell)
+    verbose : bool
+        print the strategy header, every fill and the closing summary
+    source : str
+        URL, CSV, SQLite or HDF5 file with the EOD data (see eod_data)
+    sinks : list
+        further receivers of the events of a run (see trade_ledger)
+    ledger : TradeLedger
+        fills of the current run
+    cash_curve, units_curve, wealth_curve : np.ndarray
+        cash, units and net wealth per bar of the current run (NaN
+        outside of it; net wealth is filled in by close_out)
 
     Methods
     -------
@@ -34,43 +81,92 @@ class BacktestBase:
         retrieves and prepares the base data set
     plot_data:
         plots the closing price for the symbol
+    get_indicator:
+        returns a cached rolling indicator of the data
+    column:
+        returns a column of the data as a list (for the strategy loops)
+    reset:
+        resets cash, units, trades and the ledger before a strategy run
+    notify:
+        passes an event of the run to the sinks
+    mark:
+        records cash and units at the end of a bar
+    get_date:
+        returns the date of the given bar as a string
     get_date_price:
         returns the date and price for the given bar
-    print_balance:
-        prints out the current (cash) balance
-    print_net_wealth:
-        prints out the current net wealth
     place_buy_order:
         places a buy order
     place_sell_order:
         places a sell order
     close_out:
-        closes out a long or short position
+        closes out a long or short position and returns the Metrics
+    equity:
+        returns the net wealth and exposure per bar of the current run
+    equity_curve:
+        returns cash, units, net wealth and creturns per bar of the run
     """
 
     def __init__(self, symbol, start, end, amount,
-                 ftc=0.0, ptc=0.0, verbose=True):
+                 ftc=0.0, ptc=0.0, verbose=True, source=None, sinks=None):
         self.symbol = symbol
         self.start = start
         self.end = end
         self.initial_amount = amount
-        self.amount = amount
+        self.account = Account(amount)
         self.ftc = ftc
         self.ptc = ptc
-        self.units = 0
-        self.position = 0
-        self.trades = 0
         self.verbose = verbose
+        self.source = source
+        self.sinks = list(sinks or [])
+        self.metrics = None
         self.get_data()
+        self.reset(0)
 
     def get_data(self):
         """Retrieves and prepares the data."""
-        raw = pd.read_csv('http://hilpisch.com/pyalgo_eikon_eod_data.csv',index_col=0, parse_dates=True).dropna()
-        raw = pd.DataFrame(raw[self.symbol])
-        raw = raw.loc[self.start:self.end]
-        raw.rename(columns={self.symbol: 'price'}, inplace=True)
+        raw = get_price_data(self.symbol, self.start, self.end, self.source)
         raw['return'] = np.log(raw / raw.shift(1))
         self.data = raw.dropna()
+        self.prices = self.column('price')
+
+    # the account state is kept in a __slots__ object; the strategy loops
+    # use it directly (account = self.account) instead of these properties
+    @property
+    def amount(self):
+        """Cash of the current run."""
+        return self.account.amount
+
+    @amount.setter
+    def amount(self, value):
+        self.account.amount = value
+
+    @property
+    def units(self):
+        """Units held in the current run."""
+        return self.account.units
+
+    @units.setter
+    def units(self, value):
+        self.account.units = value
+
+    @property
+    def position(self):
+        """Position of the current run (1 long, 0 neutral, -1 short)."""
+        return self.account.position
+
+    @position.setter
+    def position(self, value):
+        self.account.position = value
+
+    @property
+    def trades(self):
+        """Number of trades of the current run."""
+        return self.account.trades
+
+    @trades.setter
+    def trades(self, value):
+        self.account.trades = value
 
     def plot_data(self, cols=None):
         """Plots the closing prices for symbol."""
@@ -78,64 +174,148 @@ class BacktestBase:
             cols = ['price']
         self.data['price'].plot(figsize=(10, 6), title=self.symbol)
 
-    def get_date_price(self, bar):
-        """Return date and price for bar."""
-        date = str(self.data.index[bar])[:10]
-        price = self.data.price.iloc[bar]
-        return date, price
+    def get_indicator(self, indicator, window):
+        """Return a cached 'sma' (of price), 'momentum' (mean return) or
+        'std' (of returns) for window."""
+        column = 'price' if indicator == 'sma' else 'return'
+        return get_indicator(self.symbol, indicator, window, self.data[column])
+
+    def column(self, name):
+        """Return the column name of the data as a list of floats."""
+        return self.data[name].values.tolist()
+
+    def reset(self, bar):
+        """Resets the account before a strategy run starting at bar."""
+        self.account = Account(self.initial_amount)
+        self.first_bar = bar
+        self.ledger = TradeLedger(self.data.index)
+        self.last_bar = None
+        self.cash_curve = np.full(len(self.data), np.nan)
+        self.units_curve = np.full(len(self.data), np.nan)
+        self.wealth_curve = np.full(len(self.data), np.nan)
 
-    def print_balance(self, bar):
-        """Print out current cash balance info."""
-        date, price = self.get_date_price(bar)
-        print(f'{date} | current balance {self.amount:.2f}')
+    def mark(self, bar):
+        """Records the account at the end of bar (called by the strategy
+        loops once per bar)."""
+        account = self.account
+        self.cash_curve[bar] = account.amount
+        self.units_curve[bar] = account.units
 
-    def print_net_wealth(self, bar):
-        """Print out current cash balance info."""
-        date, price = self.get_date_price(bar)
-        net_wealth = self.units * price + self.amount
-        print(f'{date} | current net wealth {net_wealth:.2f}')
+    def notify(self, event, *args):
+        """Passes event ('start', 'fill' or 'close') with args to the
+        sinks (and to a PrintSink if verbose and none is among them)."""
+        sinks = self.sinks
+        if self.verbose and not any(isinstance(sink, PrintSink)
+                                    for sink in sinks):
+            sinks = sinks + [_PRINT]
+        for sink in sinks:
+            getattr(sink, event)(self, *args)
+
+    def get_date(self, bar):
+        """Return the date of bar (YYYY-MM-DD)."""
+        return str(self.data.index[bar])[:10]
+
+    def get_date_price(self, bar):
+        """Return date and price for bar."""
+        return self.get_date(bar), self.prices[bar]
 
     def place_buy_order(self, bar, units=None, amount=None):
         """Place a buy order."""
-        date, price = self.get_date_price(bar)
+        price = self.prices[bar]
         if units is None:
             units = int(amount / price)
-        self.amount -= (units * price) * (1 + self.ptc) + self.ftc
-        self.units += units
-        self.trades += 1
-        if self.verbose:
-            print(f'{date} | selling {units} units at {price:.2f}')
-            self.print_balance(bar)
-            self.print_net_wealth(bar)
+        account = self.account
+        account.amount -= (units * price) * (1 + self.ptc) + self.ftc
+        account.units += units
+        account.trades += 1
+        i = self.ledger.append(bar, BUY, units, price,
+                               units * price * self.ptc + self.ftc,
+                               account.amount, account.units)
+        if self.sinks or self.verbose:
+            self.notify('fill', self.ledger, i)
 
     def place_sell_order(self, bar, units=None, amount=None):
         """Place a sell order."""
-        date, price = self.get_date_price(bar)
+        price = self.prices[bar]
         if units is None:
             units = int(amount / price)
-        self.amount += (units * price) * (1 - self.ptc) - self.ftc
-        self.units -= units
-        self.trades += 1
-        if self.verbose:
-            print(f'{date} | selling {units} units at {price:.2f}')
-            self.print_balance(bar)
-            self.print_net_wealth(bar)
+        account = self.account
+        account.amount += (units * price) * (1 - self.ptc) - self.ftc
+        account.units -= units
+        account.trades += 1
+        i = self.ledger.append(bar, SELL, units, price,
+                               units * price * self.ptc + self.ftc,
+                               account.amount, account.units)
+        if self.sinks or self.verbose:
+            self.notify('fill', self.ledger, i)
+
+    def _replay(self, bar):
+        """Fills the cash and units buffers up to bar from the ledger (for
+        strategy loops that do not mark their bars)."""
+        ledger = self.ledger
+        # the account after every fill, starting with the initial one
+        filled = np.concatenate(([self.first_bar], ledger.column('bar')))
+        units = np.concatenate(([0.0], ledger.column('units_after')))
+        cash = np.concatenate(([self.initial_amount], ledger.column('cash')))
+        bars = np.arange(self.first_bar, bar + 1)
+        # account after the last fill at or before every bar
+        last = np.searchsorted(filled, bars, side='right') - 1
+        self.cash_curve[bars] = cash[last]
+        self.units_curve[bars] = units[last]
+
+    def equity(self, bar):
+        """Return net wealth and exposure for the bars from the start of the
+        run up to bar (vectorized over the per-bar buffers)."""
+        rows = slice(self.first_bar, bar + 1)
+        if np.isnan(self.cash_curve[rows]).any():
+            self._replay(bar)
+        holdings = self.units_curve[rows] * self.data['price'].values[rows]
+        net_wealth = self.cash_curve[rows] + holdings
+        self.wealth_curve[rows] = net_wealth
+        return net_wealth, holdings / net_wealth
+
+    def equity_curve(self):
+        """Return cash, units and net wealth per bar of the last run, next
+        to the market's creturns (comparable to the cstrategy of the
+        vectorized backtesters); empty before a strategy has run."""
+        if self.last_bar is None:
+            return pd.DataFrame(
+                columns=['cash', 'units', 'net_wealth', 'creturns'],
+                index=self.data.index[:0], dtype=float)
+        rows = slice(self.first_bar, self.last_bar + 1)
+        data = pd.DataFrame({'cash': self.cash_curve[rows],
+                             'units': self.units_curve[rows],
+                             'net_wealth': self.wealth_curve[rows]},
+                            index=self.data.index[rows])
+        returns = self.data['return'].values[rows].copy()
+        returns[0] = 0.0  # the run starts with the initial amount
+        data['creturns'] = self.initial_amount * np.exp(np.cumsum(returns))
+        return data
 
     def close_out(self, bar):
-        """Closing out a long or short position."""
-        date, price = self.get_date_price(bar)
+        """Closing out a long or short position; returns the Metrics of
+        the run."""
+        price = self.prices[bar]
+        self.last_bar = bar
+        net_wealth, exposure = self.equity(bar)
+        if self.units:
+            self.ledger.append(bar, SELL if self.units > 0 else BUY,
+                               abs(self.units), price, 0.0,
+                               self.amount + self.units * price, 0)
         self.amount += self.units * price
         self.units = 0
         self.trades += 1
-        # if self.verbose:
-        print(f'{date} | inventory {self.units} units at {price:.2f}')
-        print('=' * 55)
-        print('Final balance [$] {:.2f}'.format(self.amount))
-        perf = ((self.amount - self.initial_amount) /
-                self.initial_amount * 100)
-        print('Net Performance [%] {:.2f}'.format(perf))
-        print('Trades Executed [#] {:.2f}'.format(self.trades))
-        print('=' * 55)
+        # log returns end in a crash if the account is wiped out
+        floor = np.maximum(net_wealth, np.finfo(float).tiny)
+        result = metrics(
+            self.data['return'].values[self.first_bar + 1:bar + 1],
+            np.diff(np.log(floor)), self.initial_amount, exposure)
+        creturns = result.aperf - result.operf
+        self.metrics = result._replace(aperf=self.amount,
+                                       operf=self.amount - creturns)
+        if self.sinks or self.verbose:
+            self.notify('close', bar)
+        return self.metrics
 
 
 if __name__ == '__main__':
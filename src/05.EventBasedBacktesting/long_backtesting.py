@@ -11,6 +11,7 @@ Edited by Henrique Menegaz
 
 # Importa a classe base para backtesting
 from backtesting_base import BacktestBase
+from trade_ledger import PrintSink
 
 
 class BacktestLongOnly(BacktestBase):
@@ -28,31 +29,32 @@ class BacktestLongOnly(BacktestBase):
         msg = f'\n\nRunning SMA strategy | SMA1={SMA_LENGTH1} & SMA2={SMA_LENGTH2}'
         msg += f'\nfixed costs {self.ftc} | '
         msg += f'proportional costs {self.ptc}'
-        print(msg)
-        print('=' * 55)
+        self.notify('start', msg)
 
         # Inicializa variáveis de controle
-        self.position = 0  # posição inicial neutra
-        self.trades = 0  # sem trades inicialmente
-        self.amount = self.initial_amount  # reseta capital inicial
+        self.reset(SMA_LENGTH2)  # reseta a conta (posição, trades, capital)
 
         # Calcula as médias móveis
-        self.data['SMA1'] = self.data['price'].rolling(SMA_LENGTH1).mean()
-        self.data['SMA2'] = self.data['price'].rolling(SMA_LENGTH2).mean()
+        self.data['SMA1'] = self.get_indicator('sma', SMA_LENGTH1)
+        self.data['SMA2'] = self.get_indicator('sma', SMA_LENGTH2)
+        # Listas com os valores, lidas uma única vez antes do loop
+        sma1, sma2 = self.column('SMA1'), self.column('SMA2')
+        account = self.account  # estado da conta, sem properties
 
         # Loop principal da estratégia
         for bar in range(SMA_LENGTH2, len(self.data)):
-            if self.position == 0:  # Se não tem posição
-                if self.data['SMA1'].iloc[bar] > self.data['SMA2'].iloc[bar]:
+            if account.position == 0:  # Se não tem posição
+                if sma1[bar] > sma2[bar]:
                     # Compra quando SMA curta cruza acima da SMA longa
-                    self.place_buy_order(bar, amount=self.amount)
-                    self.position = 1  # assume posição comprada
-            elif self.position == 1:  # Se tem posição comprada
-                if self.data['SMA1'].iloc[bar] < self.data['SMA2'].iloc[bar]:
+                    self.place_buy_order(bar, amount=account.amount)
+                    account.position = 1  # assume posição comprada
+            elif account.position == 1:  # Se tem posição comprada
+                if sma1[bar] < sma2[bar]:
                     # Vende quando SMA curta cruza abaixo da SMA longa
-                    self.place_sell_order(bar, units=self.units)
-                    self.position = 0  # volta para neutro
-        self.close_out(bar)  # Fecha posições no final
+                    self.place_sell_order(bar, units=account.units)
+                    account.position = 0  # volta para neutro
+            self.mark(bar)  # registra caixa e unidades do bar
+        return self.close_out(bar)  # Fecha posições no final
 
     def run_momentum_strategy(self, momentum):
         """Backtesting a momentum-based strategy.
@@ -66,30 +68,30 @@ class BacktestLongOnly(BacktestBase):
         msg = f'\n\nRunning momentum strategy | {momentum} days'
         msg += f'\nfixed costs {self.ftc} | '
         msg += f'proportional costs {self.ptc}'
-        print(msg)
-        print('=' * 55)
+        self.notify('start', msg)
 
         # Inicializa variáveis de controle
-        self.position = 0  # posição inicial neutra
-        self.trades = 0  # sem trades inicialmente
-        self.amount = self.initial_amount  # reseta capital inicial
+        self.reset(momentum)  # reseta a conta (posição, trades, capital)
 
         # Calcula o momentum como média móvel dos retornos
-        self.data['momentum'] = self.data['return'].rolling(momentum).mean()
+        self.data['momentum'] = self.get_indicator('momentum', momentum)
+        mom = self.column('momentum')
+        account = self.account  # estado da conta, sem properties
 
         # Loop principal da estratégia
         for bar in range(momentum, len(self.data)):
-            if self.position == 0:  # Se não tem posição
-                if self.data['momentum'].iloc[bar] > 0:
+            if account.position == 0:  # Se não tem posição
+                if mom[bar] > 0:
                     # Compra quando momentum é positivo
-                    self.place_buy_order(bar, amount=self.amount)
-                    self.position = 1  # assume posição comprada
-            elif self.position == 1:  # Se tem posição comprada
-                if self.data['momentum'].iloc[bar] < 0:
+                    self.place_buy_order(bar, amount=account.amount)
+                    account.position = 1  # assume posição comprada
+            elif account.position == 1:  # Se tem posição comprada
+                if mom[bar] < 0:
                     # Vende quando momentum é negativo
-                    self.place_sell_order(bar, units=self.units)
-                    self.position = 0  # volta para neutro
-        self.close_out(bar)  # Fecha posições no final
+                    self.place_sell_order(bar, units=account.units)
+                    account.position = 0  # volta para neutro
+            self.mark(bar)  # registra caixa e unidades do bar
+        return self.close_out(bar)  # Fecha posições no final
 
     def run_mean_reversion_strategy(self, SMA_LENGTH, THRESHOLD):
         """Backtesting a mean reversion-based strategy.
@@ -106,30 +108,30 @@ class BacktestLongOnly(BacktestBase):
         msg += f'SMA={SMA_LENGTH} & thr={THRESHOLD}'
         msg += f'\nfixed costs {self.ftc} | '
         msg += f'proportional costs {self.ptc}'
-        print(msg)
-        print('=' * 55)
+        self.notify('start', msg)
 
         # Inicializa variáveis de controle
-        self.position = 0
-        self.trades = 0
-        self.amount = self.initial_amount
+        self.reset(SMA_LENGTH)  # reseta a conta (posição, trades, capital)
 
         # Calcula a média móvel simples
-        self.data['SMA'] = self.data['price'].rolling(SMA_LENGTH).mean()
+        self.data['SMA'] = self.get_indicator('sma', SMA_LENGTH)
+        price, sma = self.prices, self.column('SMA')
+        account = self.account  # estado da conta, sem properties
 
         # Loop principal da estratégia
         for bar in range(SMA_LENGTH, len(self.data)):
-            if self.position == 0:
+            if account.position == 0:
                 # Se não tem posição, verifica se preço está abaixo da SMA - threshold
-                if (self.data['price'].iloc[bar] < self.data['SMA'].iloc[bar] - THRESHOLD):
-                    self.place_buy_order(bar, amount=self.amount)
-                    self.position = 1
-            elif self.position == 1:
+                if (price[bar] < sma[bar] - THRESHOLD):
+                    self.place_buy_order(bar, amount=account.amount)
+                    account.position = 1
+            elif account.position == 1:
                 # Se tem posição comprada, verifica se preço retornou para SMA
-                if self.data['price'].iloc[bar] >= self.data['SMA'].iloc[bar]:
-                    self.place_sell_order(bar, units=self.units)
-                    self.position = 0
-        self.close_out(bar)  # Fecha posições no final
+                if price[bar] >= sma[bar]:
+                    self.place_sell_order(bar, units=account.units)
+                    account.position = 0
+            self.mark(bar)  # registra caixa e unidades do bar
+        return self.close_out(bar)  # Fecha posições no final
 
 
 if __name__ == '__main__':
@@ -139,10 +141,13 @@ if __name__ == '__main__':
         lobt.run_momentum_strategy(60)
         lobt.run_mean_reversion_strategy(50, 5)
 
+    # Imprime cabeçalho e resumo de cada execução, sem as ordens
+    sinks = [PrintSink(fills=False)]
+
     # Teste sem custos de transação
-    lobt = BacktestLongOnly('AAPL.O', '2010-1-1', '2019-12-31',10000, verbose=False)
+    lobt = BacktestLongOnly('AAPL.O', '2010-1-1', '2019-12-31',10000, verbose=False, sinks=sinks)
     run_strategies()
 
     # Teste com custos de transação: 10 USD fixo, 1% variável
-    lobt = BacktestLongOnly('AAPL.O', '2010-1-1', '2019-12-31',10000, 10.0, 0.01, False)
+    lobt = BacktestLongOnly('AAPL.O', '2010-1-1', '2019-12-31',10000, 10.0, 0.01, False, sinks=sinks)
     run_strategies()
\ No newline at end of file
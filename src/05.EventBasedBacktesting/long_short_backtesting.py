@@ -10,6 +10,7 @@ Edited by Henrique Menegaz
 """
 
 from backtesting_base import BacktestBase
+from trade_ledger import PrintSink
 
 
 class BacktestLongShort(BacktestBase):
@@ -44,96 +45,97 @@ class BacktestLongShort(BacktestBase):
         msg = f'\n\nRunning SMA strategy | SMA1={SMA_LENGTH1} & SMA2={SMA_LENGTH2}'
         msg += f'\nfixed costs {self.ftc} | '
         msg += f'proportional costs {self.ptc}'
-        print(msg)
-        print('=' * 55)
+        self.notify('start', msg)
 
-        self.position = 0  # initial neutral position
-        self.trades = 0  # no trades yet
-        self.amount = self.initial_amount  # reset initial capital
+        self.reset(SMA_LENGTH2)  # reset position, trades and capital
 
-        self.data['SMA1'] = self.data['price'].rolling(SMA_LENGTH1).mean()
-        self.data['SMA2'] = self.data['price'].rolling(SMA_LENGTH2).mean()
+        self.data['SMA1'] = self.get_indicator('sma', SMA_LENGTH1)
+        self.data['SMA2'] = self.get_indicator('sma', SMA_LENGTH2)
+        # plain lists, pulled once before the loop
+        sma1, sma2 = self.column('SMA1'), self.column('SMA2')
+        account = self.account  # plain attributes in the loop
 
         # The strategy is implemented in a loop that iterates over all bars in the data set.
         for bar in range(SMA_LENGTH2, len(self.data)):
             # If the position is short or neutral, it is checked whether the short-term SMA is above the long-term SMA.
-            if self.position in [0, -1]:
-                if self.data['SMA1'].iloc[bar] > self.data['SMA2'].iloc[bar]:
+            if account.position in [0, -1]:
+                if sma1[bar] > sma2[bar]:
                     self.go_long(bar, amount='all')
-                    self.position = 1  # long position
+                    account.position = 1  # long position
             # If the position is long, it is checked whether the short-term SMA is below the long-term SMA.
-            if self.position in [0, 1]:
-                if self.data['SMA1'].iloc[bar] < self.data['SMA2'].iloc[bar]:
+            if account.position in [0, 1]:
+                if sma1[bar] < sma2[bar]:
                     self.go_short(bar, amount='all')
-                    self.position = -1  # short position
-        self.close_out(bar)
+                    account.position = -1  # short position
+            self.mark(bar)  # cash and units at the end of the bar
+        return self.close_out(bar)
 
     def run_momentum_strategy(self, MOMENTUM):
         msg = f'\n\nRunning momentum strategy | {MOMENTUM} days'
         msg += f'\nfixed costs {self.ftc} | '
         msg += f'proportional costs {self.ptc}'
-        print(msg)
-        print('=' * 55)
+        self.notify('start', msg)
 
-        self.position = 0  # initial neutral position
-        self.trades = 0  # no trades yet
-        self.amount = self.initial_amount  # reset initial capital
+        self.reset(MOMENTUM)  # reset position, trades and capital
 
-        self.data['momentum'] = self.data['return'].rolling(MOMENTUM).mean()
+        self.data['momentum'] = self.get_indicator('momentum', MOMENTUM)
+        mom = self.column('momentum')
+        account = self.account  # plain attributes in the loop
 
         # The strategy is implemented in a loop that iterates over all bars in the data set.
         for bar in range(MOMENTUM, len(self.data)):
             # If the position is short or neutral, it is checked whether the momentum is positive.
-            if self.position in [0, -1]:
-                if self.data['momentum'].iloc[bar] > 0:
+            if account.position in [0, -1]:
+                if mom[bar] > 0:
                     self.go_long(bar, amount='all')
-                    self.position = 1  # long position
+                    account.position = 1  # long position
             # If the position is long, it is checked whether the momentum is negative.
-            if self.position in [0, 1]:
-                if self.data['momentum'].iloc[bar] <= 0:
+            if account.position in [0, 1]:
+                if mom[bar] <= 0:
                     self.go_short(bar, amount='all')
-                    self.position = -1  # short position
-        self.close_out(bar)
+                    account.position = -1  # short position
+            self.mark(bar)  # cash and units at the end of the bar
+        return self.close_out(bar)
 
     def run_mean_reversion_strategy(self, SMA_LENGTH, THRESHOLD):
         msg = '\n\nRunning mean reversion strategy | '
         msg += f'SMA={SMA_LENGTH} & thr={THRESHOLD}'
         msg += f'\nfixed costs {self.ftc} | '
         msg += f'proportional costs {self.ptc}'
-        print(msg)
-        print('=' * 55)
+        self.notify('start', msg)
 
-        self.position = 0  # initial neutral position
-        self.trades = 0  # no trades yet
-        self.amount = self.initial_amount  # reset initial capital
+        self.reset(SMA_LENGTH)  # reset position, trades and capital
 
-        self.data['SMA'] = self.data['price'].rolling(SMA_LENGTH).mean()
+        self.data['SMA'] = self.get_indicator('sma', SMA_LENGTH)
+        price, sma = self.prices, self.column('SMA')
+        account = self.account  # plain attributes in the loop
 
         # The strategy is implemented in a loop that iterates over all bars in the data set.    
         for bar in range(SMA_LENGTH, len(self.data)):
             # If the position is short or neutral, it is checked whether the price is below the SMA minus the threshold.
-            if self.position == 0:
-                if (self.data['price'].iloc[bar] < self.data['SMA'].iloc[bar] - THRESHOLD):
+            if account.position == 0:
+                if (price[bar] < sma[bar] - THRESHOLD):
                     # If the price is below the SMA minus the threshold, the position is opened by placing a buy order.
                     self.go_long(bar, amount=self.initial_amount)
-                    self.position = 1
-                elif (self.data['price'].iloc[bar] > self.data['SMA'].iloc[bar] + THRESHOLD):
+                    account.position = 1
+                elif (price[bar] > sma[bar] + THRESHOLD):
                     # If the price is above the SMA plus the threshold, the position is closed by placing a sell order.
                     self.go_short(bar, amount=self.initial_amount)
-                    self.position = -1
+                    account.position = -1
             # If the position is long, it is checked whether the price is above the SMA.
-            elif self.position == 1:
-                if self.data['price'].iloc[bar] >= self.data['SMA'].iloc[bar]:
+            elif account.position == 1:
+                if price[bar] >= sma[bar]:
                     # If the price is above the SMA, the position is closed by placing a sell order.
-                    self.place_sell_order(bar, units=self.units)
-                    self.position = 0
+                    self.place_sell_order(bar, units=account.units)
+                    account.position = 0
             # If the position is short, it is checked whether the price is below the SMA.
-            elif self.position == -1:
-                if self.data['price'].iloc[bar] <= self.data['SMA'].iloc[bar]:
+            elif account.position == -1:
+                if price[bar] <= sma[bar]:
                     # If the price is below the SMA, the position is closed by placing a buy order.
-                    self.place_buy_order(bar, units=-self.units)
-                    self.position = 0
-        self.close_out(bar)
+                    self.place_buy_order(bar, units=-account.units)
+                    account.position = 0
+            self.mark(bar)  # cash and units at the end of the bar
+        return self.close_out(bar)
 
 
 if __name__ == '__main__':
@@ -142,9 +144,12 @@ if __name__ == '__main__':
         lsbt.run_momentum_strategy(60)
         lsbt.run_mean_reversion_strategy(50, 5)
 
-    lsbt = BacktestLongShort('EUR=', '2010-1-1', '2019-12-31', 10000,verbose=False)
+    # print the header and summary of every run, but not the fills
+    sinks = [PrintSink(fills=False)]
+
+    lsbt = BacktestLongShort('EUR=', '2010-1-1', '2019-12-31', 10000,verbose=False, sinks=sinks)
     run_strategies()
 
     # transaction costs: 10 USD fix, 1% variable
-    lsbt = BacktestLongShort('AAPL.O', '2010-1-1', '2019-12-31',10000, 10.0, 0.01, False)
+    lsbt = BacktestLongShort('AAPL.O', '2010-1-1', '2019-12-31',10000, 10.0, 0.01, False, sinks=sinks)
     run_strategies()
\ No newline at end of file
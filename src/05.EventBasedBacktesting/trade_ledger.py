@@ -0,0 +1,145 @@
+"""Columnar trade ledger and output sinks for event-based backtesting."""
+
+import numpy as np
+import pandas as pd
+
+BUY, SELL = 1, -1
+FIELDS = (
+    ('bar', np.int64),
+    ('side', np.int8),  # BUY or SELL
+    ('units', np.float64),
+    ('price', np.float64),
+    ('cost', np.float64),  # fixed plus proportional transaction costs
+    ('cash', np.float64),  # after the fill
+    ('units_after', np.float64),
+)
+
+
+def _units(units):
+    """Formats a number of units as the former reports did (integers
+    without decimals)."""
+    return int(units) if float(units).is_integer() else units
+
+
+class TradeLedger:
+    """Preallocated, growable, array-backed record of the fills of a run.
+
+    Attributes
+    ----------
+    index : pd.DatetimeIndex
+        dates of the bars (only used to export and print dates)
+    size : int
+        number of fills recorded
+
+    Methods
+    -------
+    append:
+        records a fill and returns its row number
+    column:
+        returns one field of all fills as an array view
+    row:
+        returns one fill as a dict
+    date:
+        returns the date of a fill as a string
+    to_frame:
+        returns the fills as a DataFrame (with a date column)
+    to_parquet:
+        writes the fills to a Parquet file
+    """
+
+    def __init__(self, index=None, capacity=64):
+        self.index = index
+        self.size = 0
+        self.columns = {name: np.empty(capacity, dtype=dtype)
+                        for name, dtype in FIELDS}
+
+    def __len__(self):
+        return self.size
+
+    def _grow(self):
+        for name, values in self.columns.items():
+            grown = np.empty(2 * len(values), dtype=values.dtype)
+            grown[:self.size] = values[:self.size]
+            self.columns[name] = grown
+
+    def append(self, bar, side, units, price, cost, cash, units_after):
+        """Records a fill; returns its row number."""
+        i = self.size
+        if i == len(self.columns['bar']):
+            self._grow()
+        columns = self.columns
+        columns['bar'][i] = bar
+        columns['side'][i] = side
+        columns['units'][i] = units
+        columns['price'][i] = price
+        columns['cost'][i] = cost
+        columns['cash'][i] = cash
+        columns['units_after'][i] = units_after
+        self.size = i + 1
+        return i
+
+    def column(self, name):
+        """Returns the field name of all fills (a view)."""
+        return self.columns[name][:self.size]
+
+    def row(self, i):
+        """Returns fill i as a dict."""
+        return {name: self.columns[name][i].item() for name, _ in FIELDS}
+
+    def date(self, i):
+        """Returns the date of fill i (YYYY-MM-DD)."""
+        return str(self.index[self.columns['bar'][i]])[:10]
+
+    def to_frame(self):
+        """Returns the fills as a DataFrame, one row per fill."""
+        data = pd.DataFrame({name: self.column(name) for name, _ in FIELDS})
+        if self.index is not None:
+            data.insert(1, 'date', self.index[data['bar'].values])
+        return data
+
+    def to_parquet(self, path):
+        """Writes the fills to a Parquet file (needs pyarrow or
+        fastparquet)."""
+        self.to_frame().to_parquet(path, index=False)
+
+
+class PrintSink:
+    """Prints the runs of a backtester: the strategy header, every fill
+    (if fills) and the closing summary.
+
+    A sink is any object with the methods start, fill and close; the
+    backtester passes every event of a run to its sinks.
+    """
+
+    def __init__(self, fills=True):
+        self.fills = fills
+
+    def start(self, backtester, message):
+        print(message)
+        print('=' * 55)
+
+    def fill(self, backtester, ledger, i):
+        if not self.fills:
+            return
+        row = ledger.row(i)
+        date = ledger.date(i)
+        action = 'buying' if row['side'] == BUY else 'selling'
+        print(f'{date} | {action} {_units(row["units"])} units at '
+              f'{row["price"]:.2f}')
+        print(f'{date} | current balance {row["cash"]:.2f}')
+        net_wealth = row['units_after'] * row['price'] + row['cash']
+        print(f'{date} | current net wealth {net_wealth:.2f}')
+
+    def close(self, backtester, bar):
+        date, price = backtester.get_date_price(bar)
+        print(f'{date} | inventory {backtester.units} units at {price:.2f}')
+        print('=' * 55)
+        print('Final balance [$] {:.2f}'.format(backtester.amount))
+        perf = ((backtester.amount - backtester.initial_amount) /
+                backtester.initial_amount * 100)
+        print('Net Performance [%] {:.2f}'.format(perf))
+        print('Trades Executed [#] {:.2f}'.format(backtester.trades))
+        print('Sharpe Ratio {:.2f}'.format(backtester.metrics.sharpe))
+        print('Max Drawdown [%] {:.2f}'.format(
+            backtester.metrics.max_drawdown * 100))
+        print('=' * 55)
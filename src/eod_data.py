@@ -0,0 +1,272 @@
+"""Shared data-source layer for the EOD price file.
+
+Every backtester in the book reads the same end-of-day file
+(``pyalgo_eikon_eod_data.csv``). This module loads it once, keeps a
+columnar copy on disk (a memory-mapped ``price_store``, one contiguous
+float64 row per symbol plus the date index) and memoizes the opened store
+for the lifetime of the process, so building hundreds of backtester
+instances costs a single download and CSV parse, and worker processes
+share one page-cached copy of the prices.
+
+The on-disk copy is invalidated by checksum: local files are re-hashed only
+when their mtime or size changes, remote files are re-downloaded once the
+cached copy is older than ``MAX_AGE`` seconds.
+
+Offline mode (``offline=True`` or ``PYALGO_OFFLINE=1``) never touches the
+network: it reads a local CSV file or an existing on-disk copy only.
+
+A source ending in ``.sqlite`` or ``.db`` is read through
+``market_data_reader`` (the store written by ``b_sqlite_cron.py``), one
+ending in ``.h5`` through ``hdf5_store``.
+"""
+
+import hashlib
+import io
+import json
+import os
+import time
+import urllib.request
+
+import pandas as pd
+
+from hdf5_store import HDF5PriceStore
+from market_data_reader import get_reader, is_database
+from price_store import PriceStore, write_store
+
+EOD_URL = 'http://hilpisch.com/pyalgo_eikon_eod_data.csv'
+CACHE_DIR = os.environ.get(
+    'PYALGO_DATA_DIR',
+    os.path.join(os.path.expanduser('~'), '.pyalgo_data')
+)
+MAX_AGE = 24 * 60 * 60  # seconds before a remote file is checked again
+
+_default_source = os.environ.get('PYALGO_EOD_SOURCE', EOD_URL)
+_offline = os.environ.get('PYALGO_OFFLINE', '0') not in ('', '0')
+_memo = {}
+
+
+def set_default_source(source=None, offline=None):
+    """Sets the process-wide default source and offline flag.
+
+    Parameters
+    ==========
+    source: str
+        URL or path of a local CSV file in the EOD format
+    offline: bool
+        if True, never access the network
+    """
+    global _default_source, _offline
+    if source is not None:
+        _default_source = source
+    if offline is not None:
+        _offline = offline
+
+
+def get_default_source():
+    """Returns the process-wide default source."""
+    return _default_source
+
+
+def is_remote(source):
+    """Returns True if the source has to be downloaded."""
+    return source.startswith(('http://', 'https://'))
+
+
+def cache_path(source):
+    """Returns the directory holding the on-disk copy of source."""
+    key = hashlib.sha1(source.encode()).hexdigest()[:16]
+    return os.path.join(CACHE_DIR, key)
+
+
+def _read_manifest(path):
+    if not os.path.isfile(os.path.join(path, 'store.json')):
+        return None
+    try:
+        with open(os.path.join(path, 'manifest.json')) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_manifest(path, manifest):
+    tmp = os.path.join(path, 'manifest.json.tmp')
+    with open(tmp, 'w') as f:
+        json.dump(manifest, f)
+    os.replace(tmp, os.path.join(path, 'manifest.json'))
+
+
+def _parse(content):
+    return pd.read_csv(io.BytesIO(content), index_col=0,
+                       parse_dates=True).dropna()
+
+
+def _write_cache(path, raw, manifest):
+    """Writes raw as a price store and records it in the manifest."""
+    write_store(path, raw)
+    _write_manifest(path, manifest)
+    return PriceStore(path)
+
+
+def _load_local(source, path):
+    st = os.stat(source)
+    stamp = [st.st_mtime_ns, st.st_size]
+    manifest = _read_manifest(path)
+    if manifest is not None and manifest['stamp'] == stamp:
+        return PriceStore(path)
+    with open(source, 'rb') as f:
+        content = f.read()
+    checksum = hashlib.sha256(content).hexdigest()
+    if manifest is not None and manifest['checksum'] == checksum:
+        manifest['stamp'] = stamp
+        _write_manifest(path, manifest)
+        return PriceStore(path)
+    return _write_cache(path, _parse(content),
+                        {'source': source, 'checksum': checksum,
+                         'stamp': stamp})
+
+
+def _load_remote(source, path, offline):
+    manifest = _read_manifest(path)
+    if manifest is not None and (
+            offline or time.time() - manifest['fetched'] < MAX_AGE):
+        return PriceStore(path)
+    if offline:
+        raise IOError(f'No local copy of {source} available in offline mode.')
+    with urllib.request.urlopen(source) as response:
+        content = response.read()
+    checksum = hashlib.sha256(content).hexdigest()
+    if manifest is not None and manifest['checksum'] == checksum:
+        manifest['fetched'] = time.time()
+        _write_manifest(path, manifest)
+        return PriceStore(path)
+    return _write_cache(path, _parse(content),
+                        {'source': source, 'checksum': checksum,
+                         'fetched': time.time()})
+
+
+def _stamp(source, offline):
+    """Returns a cheap token telling whether a memoized store is current."""
+    if is_remote(source):
+        # remote stores are trusted for MAX_AGE seconds
+        return None if offline else int(time.time() // MAX_AGE)
+    st = os.stat(source)
+    return st.st_mtime_ns, st.st_size
+
+
+def load_price_store(source=None, offline=None):
+    """Returns the memory-mapped PriceStore for source.
+
+    Parameters
+    ==========
+    source: str
+        URL or path of a local CSV file (defaults to ``EOD_URL``)
+    offline: bool
+        if True, only local files and on-disk copies are read
+    """
+    source = source or _default_source
+    offline = _offline if offline is None else offline
+    stamp = _stamp(source, offline)
+    hit = _memo.get(source)
+    if hit is not None and hit[0] == stamp:
+        return hit[1]
+    path = cache_path(source)
+    if is_remote(source):
+        store = _load_remote(source, path, offline)
+    else:
+        store = _load_local(source, path)
+    _memo[source] = (stamp, store)
+    return store
+
+
+def load_eod_data(source=None, offline=None):
+    """Returns the full EOD data set (rows with missing values dropped).
+
+    The returned frame is backed by the read-only store and must not be
+    modified.
+    """
+    return load_price_store(source, offline).frame()
+
+
+def get_price_data(symbol, start=None, end=None, source=None):
+    """Returns a single-column frame ('price') for symbol.
+
+    The prices are a view into the memory-mapped store; columns can be
+    added to the frame, but the prices must not be modified in place.
+
+    Parameters
+    ==========
+    symbol: str
+        RIC symbol with which to work
+    start: str
+        start date for data selection
+    end: str
+        end date for data selection
+    source: str
+        URL, path of a local CSV file, SQLite database or HDF5 store
+        (defaults to ``EOD_URL``)
+    """
+    source = source or _default_source
+    if is_database(source):
+        return get_reader(source).price_data(symbol, start, end)
+    if source.endswith(('.h5', '.hdf5')):
+        return HDF5PriceStore(source).price_data(symbol, start, end)
+    return load_price_store(source).price_data(symbol, start, end)
+
+
+def get_panel_data(symbols='all', start=None, end=None, source=None):
+    """Returns the prices of several symbols as a (dates x symbols) frame.
+
+    Dates on which any of the symbols has no price are dropped, as in the
+    EOD file.
+
+    Parameters
+    ==========
+    symbols: list or str
+        symbols to select or 'all'
+    start: str
+        start date for data selection
+    end: str
+        end date for data selection
+    source: str
+        URL, path of a local CSV file, SQLite database or HDF5 store
+        (defaults to ``EOD_URL``)
+    """
+    source = source or _default_source
+    if is_database(source):
+        reader = get_reader(source)
+        if symbols == 'all':
+            symbols = reader.symbols()
+        return reader.read_panel(symbols, start, end).dropna()
+    if source.endswith(('.h5', '.hdf5')):
+        store = HDF5PriceStore(source)
+        if symbols == 'all':
+            symbols = store.symbols()
+        return pd.DataFrame({
+            symbol: store.price_data(symbol, start, end)['price']
+            for symbol in symbols
+        }).dropna()
+    store = load_price_store(source)
+    if symbols == 'all':
+        symbols = store.symbols
+    return store.panel_data(symbols, start, end)
+
+
+def clear_cache(disk=False):
+    """Drops the in-process memo and, optionally, all on-disk copies."""
+    _memo.clear()
+    if disk and os.path.isdir(CACHE_DIR):
+        for key in os.listdir(CACHE_DIR):
+            path = os.path.join(CACHE_DIR, key)
+            for name in os.listdir(path):
+                os.remove(os.path.join(path, name))
+            os.rmdir(path)
+
+
+if __name__ == '__main__':
+    t0 = time.time()
+    raw = load_eod_data()
+    print(f'first load  {time.time() - t0:.4f}s')
+    t0 = time.time()
+    raw = load_eod_data()
+    print(f'memoized    {time.time() - t0:.6f}s')
+    print(raw.info())
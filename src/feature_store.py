@@ -0,0 +1,322 @@
+"""Columnar float32 feature store for the AI backtesters and notebooks.
+
+The standard feature set of a symbol is computed once from its full price
+history and kept on disk, one file per column:
+
+``dates.i8``, ``price.f8``, ``return.f8``
+    int64 date index (nanoseconds since the epoch), prices and log
+    returns in full precision
+``<feature>.f4``
+    float32 feature columns (see ``feature_names``)
+``store.json``
+    symbol, number of bars, feature specification and column names
+
+Every feature of bar t only uses prices up to bar t - 1 (lagged returns
+and rolling statistics shifted by one bar), so bar t's return is the
+target. Columns are selected by name and read through ``np.memmap``
+without recomputing anything. New bars are appended to every column
+file; the number of bars in ``store.json`` is updated last, so readers
+never see a partial append. Rolling statistics are computed window by
+window (no running sums), which makes an append bit-identical to a full
+rebuild.
+
+Stores live in ``FEATURE_DIR``, one directory per data source (as the
+price caches of ``eod_data``) and symbol::
+
+    features = get_features('EUR=', ['lag_1', 'momentum_5', 'channel_20'])
+"""
+
+import hashlib
+import json
+import os
+from urllib.parse import quote
+
+import numpy as np
+import pandas as pd
+from numpy.lib.stride_tricks import sliding_window_view
+
+from eod_data import get_default_source, get_price_data
+
+FEATURE_DIR = os.environ.get(
+    'PYALGO_FEATURE_DIR',
+    os.path.join(os.path.expanduser('~'), '.pyalgo_features')
+)
+SPEC = {
+    'lags': 10,  # lagged returns lag_1 .. lag_10
+    'momentum': [5, 20],  # mean return
+    'volatility': [20],  # standard deviation of returns
+    'distance': [50],  # price minus SMA
+    'channel': [20],  # position within the min/max channel (0 to 1)
+}
+
+
+def feature_names(spec=SPEC):
+    """Returns the names of the feature columns of spec."""
+    names = [f'lag_{lag}' for lag in range(1, spec['lags'] + 1)]
+    for kind in ('momentum', 'volatility', 'distance', 'channel'):
+        names.extend(f'{kind}_{window}' for window in spec[kind])
+    return names
+
+
+def context(spec=SPEC):
+    """Number of preceding bars the features of a bar depend on."""
+    windows = [w for kind in ('momentum', 'volatility', 'distance', 'channel')
+               for w in spec[kind]]
+    return max([spec['lags']] + windows) + 1
+
+
+def _shift(values, periods=1):
+    out = np.full(len(values), np.nan)
+    if periods < len(values):
+        out[periods:] = values[:len(values) - periods]
+    return out
+
+
+def _rolling(values, window, reduce):
+    out = np.full(len(values), np.nan)
+    if len(values) >= window:
+        out[window - 1:] = reduce(sliding_window_view(values, window), axis=1)
+    return out
+
+
+def compute_features(price, spec=SPEC):
+    """Returns the log returns and the feature columns (float32) of a
+    price array."""
+    price = np.asarray(price, dtype=float)
+    returns = np.log(price / _shift(price))
+    columns = {}
+    for lag in range(1, spec['lags'] + 1):
+        columns[f'lag_{lag}'] = _shift(returns, lag)
+    for w in spec['momentum']:
+        columns[f'momentum_{w}'] = _shift(_rolling(returns, w, np.mean))
+    for w in spec['volatility']:
+        std = _rolling(returns, w, lambda v, axis: v.std(axis=axis, ddof=1))
+        columns[f'volatility_{w}'] = _shift(std)
+    for w in spec['distance']:
+        columns[f'distance_{w}'] = _shift(price - _rolling(price, w, np.mean))
+    for w in spec['channel']:
+        low = _rolling(price, w, np.min)
+        high = _rolling(price, w, np.max)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            channel = (price - low) / (high - low)
+        columns[f'channel_{w}'] = _shift(channel)
+    return returns, {name: values.astype(np.float32)
+                     for name, values in columns.items()}
+
+
+class FeatureStore(object):
+    """Directory of per-symbol columnar feature stores.
+
+    Attributes
+    ==========
+    path: str
+        directory holding one sub-directory per symbol
+
+    Methods
+    =======
+    write:
+        computes and writes the features of a price series
+    append:
+        extends the features by the bars after the last stored date
+    columns:
+        returns the names of the stored feature columns
+    dates:
+        returns the stored date index
+    column:
+        returns one column as a read-only memory-mapped array
+    matrix:
+        returns selected columns as a (bars x columns) float32 array
+    frame:
+        returns price, return and selected columns as a frame
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def _dir(self, symbol):
+        return os.path.join(self.path, quote(symbol, safe=''))
+
+    def has(self, symbol):
+        return os.path.isfile(os.path.join(self._dir(symbol), 'store.json'))
+
+    def meta(self, symbol):
+        with open(os.path.join(self._dir(symbol), 'store.json')) as f:
+            return json.load(f)
+
+    def _write_meta(self, symbol, meta):
+        tmp = os.path.join(self._dir(symbol), 'store.json.tmp')
+        with open(tmp, 'w') as f:
+            json.dump(meta, f)
+        os.replace(tmp, os.path.join(self._dir(symbol), 'store.json'))
+
+    def _columns(self, dates, price, spec, start=0):
+        """Yields (file name, values) of all columns from bar start on."""
+        returns, features = compute_features(price, spec)
+        yield 'dates.i8', dates[start:]
+        yield 'price.f8', price[start:]
+        yield 'return.f8', returns[start:]
+        for name in feature_names(spec):
+            yield f'{name}.f4', features[name][start:]
+
+    def write(self, symbol, prices, spec=SPEC):
+        """Computes the features of prices (pd.Series) and writes them,
+        replacing an existing store of symbol."""
+        path = self._dir(symbol)
+        os.makedirs(path, exist_ok=True)
+        dates = prices.index.values.astype('datetime64[ns]').view('int64')
+        price = np.asarray(prices.values, dtype=float)
+        for name, values in self._columns(dates, price, spec):
+            tmp = os.path.join(path, name + '.tmp')
+            np.ascontiguousarray(values).tofile(tmp)
+            os.replace(tmp, os.path.join(path, name))
+        self._write_meta(symbol, {'symbol': symbol, 'length': len(dates),
+                                  'spec': spec,
+                                  'columns': feature_names(spec)})
+        return len(dates)
+
+    def append(self, symbol, prices):
+        """Appends the bars of prices (pd.Series) after the last stored
+        date; returns the number of new bars."""
+        meta = self.meta(symbol)
+        length, spec = meta['length'], meta['spec']
+        stored = self.column(symbol, 'dates')
+        dates = prices.index.values.astype('datetime64[ns]').view('int64')
+        new = dates > stored[-1] if length else np.ones(len(dates), bool)
+        if not new.any():
+            return 0
+        # the new bars' features only depend on the last context bars
+        keep = max(0, length - context(spec))
+        price = np.concatenate((self.column(symbol, 'price')[keep:],
+                                np.asarray(prices.values, dtype=float)[new]))
+        dates = np.concatenate((stored[keep:], dates[new]))
+        path = self._dir(symbol)
+        for name, values in self._columns(dates, price, spec,
+                                          start=length - keep):
+            with open(os.path.join(path, name), 'r+b') as f:
+                # drop the remains of an interrupted append
+                f.truncate(length * values.itemsize)
+                f.seek(0, os.SEEK_END)
+                f.write(np.ascontiguousarray(values).tobytes())
+        meta['length'] = len(dates) + keep
+        self._write_meta(symbol, meta)
+        return int(new.sum())
+
+    def columns(self, symbol):
+        """Returns the names of the feature columns of symbol."""
+        return self.meta(symbol)['columns']
+
+    def column(self, symbol, name, meta=None):
+        """Returns the column name ('dates', 'price', 'return' or a
+        feature) as a read-only memory-mapped array."""
+        meta = meta or self.meta(symbol)
+        dtype = {'dates': np.int64, 'price': np.float64,
+                 'return': np.float64}.get(name, np.float32)
+        suffix = {np.int64: 'i8', np.float64: 'f8'}.get(dtype, 'f4')
+        if dtype is np.float32 and name not in meta['columns']:
+            raise KeyError(f'Feature {name} not in the store of '
+                           f'{meta["symbol"]}.')
+        return np.memmap(os.path.join(self._dir(symbol), f'{name}.{suffix}'),
+                         dtype=dtype, mode='r', shape=(meta['length'],))
+
+    def dates(self, symbol):
+        """Returns the date index of symbol."""
+        return pd.DatetimeIndex(
+            np.asarray(self.column(symbol, 'dates')).view('datetime64[ns]'))
+
+    def bounds(self, symbol, start=None, end=None):
+        """Returns (i, j) such that the bars i to j - 1 lie within
+        [start, end]."""
+        sl = self.dates(symbol).slice_indexer(start, end)
+        return sl.start or 0, sl.stop if sl.stop is not None else None
+
+    def matrix(self, symbol, columns, start=None, end=None):
+        """Returns the feature columns as a (bars x columns) float32
+        array (one copy of the selected bars)."""
+        meta = self.meta(symbol)
+        i, j = self.bounds(symbol, start, end)
+        return np.column_stack([self.column(symbol, name, meta)[i:j]
+                                for name in columns])
+
+    def frame(self, symbol, columns=None, start=None, end=None):
+        """Returns price, return and the feature columns (default: all)
+        of symbol as a frame."""
+        meta = self.meta(symbol)
+        columns = meta['columns'] if columns is None else list(columns)
+        i, j = self.bounds(symbol, start, end)
+        data = {name: np.asarray(self.column(symbol, name, meta)[i:j])
+                for name in ['price', 'return'] + columns}
+        return pd.DataFrame(data, index=self.dates(symbol)[i:j])
+
+
+class FeatureMatrix(object):
+    """Stored feature columns aligned with the data of a backtester; a
+    drop-in for LagMatrix.
+
+    Attributes
+    ==========
+    lagged: np.ndarray
+        (bars x columns) features for the rows of the backtester's data
+    returns: np.ndarray
+        log returns of the backtester's data
+    first: int
+        first row without NaN features
+    """
+
+    def __init__(self, store, symbol, columns, index, returns):
+        dates = store.dates(symbol)
+        i = dates.searchsorted(index[0])
+        if not dates[i:i + len(index)].equals(pd.DatetimeIndex(index)):
+            raise ValueError(f'The feature store of {symbol} does not cover '
+                             'the data; run update_features.')
+        features = store.matrix(symbol, columns)[i:i + len(index)]
+        self.lagged = np.asarray(features, dtype=float)
+        self.returns = np.asarray(returns, dtype=float)
+        valid = np.isfinite(self.lagged).all(axis=1)
+        self.first = int(np.argmax(valid)) if valid.any() else len(valid)
+
+    def first_row(self, lags=None):
+        """Returns the first row with complete features."""
+        return self.first
+
+    def matrix(self, lags=None):
+        """Returns the (bars x columns) feature matrix."""
+        return self.lagged
+
+    def window(self, i, j, lags=None):
+        """Returns the features and targets of the rows [i, j) with
+        complete features."""
+        start = max(i, self.first)
+        rows = slice(start, max(start, j))
+        return self.lagged[rows], self.returns[rows]
+
+
+def feature_store(source=None):
+    """Returns the FeatureStore of a data source."""
+    source = source or get_default_source()
+    key = hashlib.sha1(source.encode()).hexdigest()[:16]
+    return FeatureStore(os.path.join(FEATURE_DIR, key))
+
+
+def update_features(symbol, source=None, spec=SPEC, rebuild=False):
+    """Builds the feature store of symbol or appends the bars the source
+    has added since; returns the FeatureStore."""
+    store = feature_store(source)
+    prices = get_price_data(symbol, source=source)['price'].dropna()
+    if rebuild or not store.has(symbol):
+        store.write(symbol, prices, spec)
+    else:
+        store.append(symbol, prices)
+    return store
+
+
+def get_features(symbol, columns=None, start=None, end=None, source=None):
+    """Returns price, return and feature columns of symbol, building or
+    extending the store first if needed."""
+    return update_features(symbol, source).frame(symbol, columns, start, end)
+
+
+if __name__ == '__main__':
+    store = update_features('EUR=', rebuild=True)
+    print(store.columns('EUR='))
+    print(get_features('EUR=', ['lag_1', 'momentum_5', 'volatility_20',
+                                'distance_50', 'channel_20']).tail())
@@ -0,0 +1,168 @@
+"""Chunked, compressed and queryable HDF5 store for price data.
+
+The HDF5 files used so far (``03.VectorizedBackTesting/data.h5`` and the
+``02.StoreData`` notebooks) are written in pandas' fixed format: every read
+loads the whole frame and every update rewrites it. This store keeps one
+node per symbol in appendable table format instead:
+
+* the date index is a PyTables-indexed column, so ``where`` clauses
+  (``index >= start & index <= end``) read only the requested rows
+* data is chunked and blosc-compressed
+* daily appends add new rows without rewriting the file
+
+The vectorized backtesters load from it selectively through
+``source='prices.h5'`` (see eod_data). Requires PyTables (``tables``).
+"""
+
+import re
+import sys
+
+import pandas as pd
+
+COMPLIB = 'blosc'
+COMPLEVEL = 9
+EXPECTED_ROWS = 100000  # sizes the chunks of a new node
+
+
+def node_key(symbol):
+    """Returns the node of symbol, e.g. '.SPX' -> '/prices/s_x2eSPX'."""
+    name = re.sub(r'\W', lambda m: f'x{ord(m.group()):02x}', symbol)
+    return f'/prices/s_{name}'
+
+
+def _term(start, end):
+    """Builds a where clause with the semantics of ``.loc[start:end]``."""
+    terms = []
+    if start is not None:
+        start = (pd.Period(start).start_time if isinstance(start, str)
+                 else pd.Timestamp(start))
+        terms.append(f"index >= '{start}'")
+    if end is not None:
+        end = (pd.Period(end).end_time if isinstance(end, str)
+               else pd.Timestamp(end))
+        terms.append(f"index <= '{end}'")
+    return ' & '.join(terms) or None
+
+
+class HDF5PriceStore(object):
+    """Table-format HDF5 store with one node per symbol.
+
+    Attributes
+    ==========
+    path: str
+        path of the HDF5 file
+    complib: str
+        compression library
+    complevel: int
+        compression level (0-9)
+
+    Methods
+    =======
+    symbols:
+        returns the stored symbols
+    write:
+        (re)writes the full history of a symbol
+    append:
+        appends the rows newer than the last stored date
+    read:
+        reads a date range of a symbol with a where clause
+    price_data:
+        returns a single-column 'price' frame for the backtesters
+    """
+
+    def __init__(self, path, complib=COMPLIB, complevel=COMPLEVEL):
+        self.path = path
+        self.complib = complib
+        self.complevel = complevel
+
+    def _open(self, mode='r'):
+        return pd.HDFStore(self.path, mode, complib=self.complib,
+                           complevel=self.complevel)
+
+    def symbols(self):
+        """Returns the stored symbols."""
+        with self._open() as h5:
+            return [str(h5.get_storer(key).attrs.symbol) for key in h5.keys()
+                    if key.startswith('/prices/')]
+
+    def write(self, symbol, data):
+        """(Re)writes the full history of symbol."""
+        key = node_key(symbol)
+        with self._open('a') as h5:
+            if key in h5:
+                h5.remove(key)
+            h5.append(key, data, format='table', index=False,
+                      expectedrows=max(len(data), EXPECTED_ROWS))
+            h5.create_table_index(key, columns=['index'], optlevel=9,
+                                  kind='full')
+            h5.get_storer(key).attrs.symbol = symbol
+
+    def append(self, symbol, data):
+        """Appends the rows of data newer than the last stored date.
+
+        Returns the number of rows written.
+        """
+        key = node_key(symbol)
+        with self._open('a') as h5:
+            if key not in h5:
+                last = None
+            else:
+                nrows = h5.get_storer(key).nrows
+                last = h5.select(key, start=nrows - 1).index[-1]
+        if last is None:
+            self.write(symbol, data)
+            return len(data)
+        data = data[data.index > last]
+        if len(data):
+            with self._open('a') as h5:
+                h5.append(key, data, format='table')
+        return len(data)
+
+    def read(self, symbol, start=None, end=None, columns=None):
+        """Reads the rows of symbol within [start, end]."""
+        with self._open() as h5:
+            return h5.select(node_key(symbol), where=_term(start, end),
+                             columns=columns)
+
+    def price_data(self, symbol, start=None, end=None, field=None):
+        """Returns a 'price' frame for symbol.
+
+        field defaults to 'close' for bar data and to the only column for
+        single-column nodes (e.g. imported EOD prices).
+        """
+        data = self.read(symbol, start, end)
+        if field is None:
+            field = 'close' if 'close' in data.columns else data.columns[0]
+        return pd.DataFrame({'price': data[field]}).dropna()
+
+
+def import_frame(path, raw):
+    """Writes every column of raw (dates x symbols) as a 'price' node."""
+    store = HDF5PriceStore(path)
+    for symbol in raw.columns:
+        store.write(symbol, pd.DataFrame({'price': raw[symbol]}))
+    return store
+
+
+def convert_fixed(src, dst, symbol, key='data'):
+    """Copies a fixed-format frame (e.g. data.h5 '/data') into the store."""
+    data = pd.read_hdf(src, key)
+    store = HDF5PriceStore(dst)
+    store.write(symbol, data)
+    return store
+
+
+if __name__ == '__main__':
+    # python hdf5_store.py convert data.h5 prices.h5 AAPL
+    # python hdf5_store.py import prices.h5 [EOD source]
+    if sys.argv[1] == 'convert':
+        store = convert_fixed(sys.argv[2], sys.argv[3], sys.argv[4])
+        print(store.read(sys.argv[4]).tail())
+    elif sys.argv[1] == 'import':
+        from eod_data import load_eod_data
+
+        source = sys.argv[3] if len(sys.argv) > 3 else None
+        store = import_frame(sys.argv[2], load_eod_data(source))
+        print(store.symbols())
+    else:
+        print('Enter convert or import')
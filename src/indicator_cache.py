@@ -0,0 +1,134 @@
+"""Process-wide LRU cache for rolling indicators.
+
+Parameter sweeps call ``rolling(n).mean()`` (SMA, momentum) and
+``rolling(n).std()`` for the same series and windows over and over. The
+backtesters ask this cache instead; results are keyed by
+(symbol, indicator, window) plus a cheap fingerprint of the input series
+(length, first/last date and value), evicted least recently used first
+once the memory budget is exceeded, and returned as read-only arrays.
+
+``cache_stats()`` reports hits, misses and evictions to tune the budget.
+"""
+
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+BUDGET = 256 * 2**20  # bytes
+
+
+def _rolling_mean(series, window):
+    return series.rolling(window).mean()
+
+
+def _rolling_std(series, window):
+    return series.rolling(window).std()
+
+
+INDICATORS = {
+    'sma': _rolling_mean,  # of prices
+    'momentum': _rolling_mean,  # of returns
+    'std': _rolling_std,
+}
+
+
+class IndicatorCache(object):
+    """Memory-budgeted LRU cache of indicator arrays.
+
+    Attributes
+    ==========
+    budget: int
+        maximum number of bytes held by the cached arrays
+
+    Methods
+    =======
+    get:
+        returns an indicator, computing it on a miss
+    stats:
+        returns hit/miss/eviction counters and the memory in use
+    clear:
+        drops all entries and resets the counters
+    """
+
+    def __init__(self, budget=BUDGET):
+        self.budget = budget
+        self.lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        self.entries = OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, symbol, indicator, window, series):
+        """Returns indicator(series, window) as a read-only array.
+
+        Parameters
+        ==========
+        symbol: str
+            symbol the series belongs to
+        indicator: str
+            one of INDICATORS ('sma', 'momentum', 'std')
+        window: int
+            rolling window length
+        series: pd.Series
+            input series (prices for 'sma', returns otherwise)
+        """
+        window = int(window)
+        if len(series) == 0:
+            return INDICATORS[indicator](series, window).values
+        values = series.values
+        key = (symbol, indicator, window, len(series), series.index[0],
+               series.index[-1], float(values[0]), float(values[-1]))
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key]
+            self.misses += 1
+        result = np.asarray(INDICATORS[indicator](series, window).values,
+                            dtype=float)
+        result.flags.writeable = False
+        with self.lock:
+            if key not in self.entries:
+                self.entries[key] = result
+                self.nbytes += result.nbytes
+                while self.nbytes > self.budget and len(self.entries) > 1:
+                    _, old = self.entries.popitem(last=False)
+                    self.nbytes -= old.nbytes
+                    self.evictions += 1
+        return result
+
+    def stats(self):
+        """Returns the counters and the memory in use."""
+        requests = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / requests if requests else 0.0,
+            'evictions': self.evictions,
+            'entries': len(self.entries),
+            'nbytes': self.nbytes,
+            'budget': self.budget,
+        }
+
+
+_cache = IndicatorCache()
+
+
+def get_indicator(symbol, indicator, window, series):
+    """Returns an indicator from the process-wide cache."""
+    return _cache.get(symbol, indicator, window, series)
+
+
+def cache_stats():
+    """Returns the statistics of the process-wide cache."""
+    return _cache.stats()
+
+
+def set_budget(budget):
+    """Changes the memory budget (bytes) of the process-wide cache."""
+    _cache.budget = budget
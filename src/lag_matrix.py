@@ -0,0 +1,77 @@
+"""Zero-copy lag matrices for the regression and classification backtesters.
+
+The AI backtesters regress the return of a bar on the returns of the
+``lags`` bars before it. Instead of a shifted DataFrame column per lag
+and per date range, the full history is turned into one strided view::
+
+    X[t] = (r[t - 1], r[t - 2], ..., r[t - lags])
+
+Rows before the first ``lags`` bars hold NaN. The training and test
+windows of ``run_strategy`` are then row slices ``X[i + lags:j]`` and the
+design matrices of smaller lag orders are column slices ``X[:, :lags]``,
+so the matrix is built (one padded copy of the returns) only when a wider
+one is requested.
+"""
+
+import numpy as np
+import pandas as pd
+from numpy.lib.stride_tricks import sliding_window_view
+
+
+def row_bounds(index, start, end):
+    """Returns the positions [i, j) of the rows of index within [start, end]
+    (the rows a boolean mask index >= start & index <= end selects)."""
+    return (index.searchsorted(pd.Timestamp(start), 'left'),
+            index.searchsorted(pd.Timestamp(end), 'right'))
+
+
+def lag_matrix(returns, lags):
+    """Returns the (bars x lags) lag matrix of returns as a read-only view."""
+    padded = np.concatenate((np.full(lags, np.nan), returns))
+    return sliding_window_view(padded, lags)[:len(returns), ::-1]
+
+
+class LagMatrix(object):
+    """Lag matrix of a return series, widened on demand.
+
+    Attributes
+    ==========
+    returns: np.ndarray
+        log returns of the full history
+    width: int
+        number of lags of the widest matrix built so far
+
+    Methods
+    =======
+    matrix:
+        returns the lag matrix for a number of lags (a view)
+    window:
+        returns features and targets of a row range (views)
+    first_row:
+        returns the first row with all lags
+    """
+
+    def __init__(self, returns):
+        self.returns = np.asarray(returns, dtype=float)
+        self.width = 0
+        self.lagged = None
+
+    def matrix(self, lags):
+        """Returns the (bars x lags) lag matrix, reusing the widest one."""
+        if lags > self.width:
+            self.lagged = lag_matrix(self.returns, lags)
+            self.width = lags
+        return self.lagged[:, :lags]
+
+    def first_row(self, lags):
+        """Returns the first row with all lags (rows before hold NaN)."""
+        return lags
+
+    def window(self, i, j, lags):
+        """Returns the features and targets of the rows [i + lags, j).
+
+        Like shifting within the rows [i, j), the first lags rows are
+        dropped so that no return from before row i is used.
+        """
+        rows = slice(i + lags, max(i + lags, j))
+        return self.matrix(lags)[rows], self.returns[rows]
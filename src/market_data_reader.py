@@ -0,0 +1,159 @@
+"""Indexed read API over the market_data.sqlite store.
+
+``02.StoreData/b_sqlite_cron.py`` writes daily bars into the ``stock_data``
+table, keyed by (symbol, date). This module reads them back with range
+scans on that key and returns NumPy arrays, a wide (dates x symbols) panel
+or the single-column 'price' frame the backtesters expect, so any
+``get_data()`` can point at the database instead of the remote CSV::
+
+    SMAVectorBacktester('AAPL', 42, 252, '2015-1-1', '2020-12-31',
+                        source='market_data.sqlite')
+
+Each process keeps one read-only connection per database and a small LRU
+of recently read ranges, which is dropped as soon as another connection
+(e.g. the cron job) commits new data.
+"""
+
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+CACHE_SIZE = 128  # recently read (symbol, field, start, end) ranges
+FIELDS = ('open', 'high', 'low', 'close', 'volume')
+
+_readers = {}
+
+
+def is_database(source):
+    """Returns True if source names a SQLite database."""
+    return source is not None and source.endswith(('.sqlite', '.db'))
+
+
+def _bound(date, upper=False):
+    """Converts a (partial) date to the ISO text stored in the table."""
+    if date is None:
+        return None
+    if isinstance(date, str):
+        period = pd.Period(date)
+        date = period.end_time if upper else period.start_time
+    return pd.Timestamp(date).strftime('%Y-%m-%d')
+
+
+class MarketDataReader(object):
+    """Read-only access to the stock_data table.
+
+    Attributes
+    ==========
+    path: str
+        path of the SQLite database
+    cache_size: int
+        number of ranges kept in the LRU
+
+    Methods
+    =======
+    symbols:
+        returns the stored symbols
+    read:
+        returns dates and values of one symbol as NumPy arrays
+    read_panel:
+        returns a wide (dates x symbols) frame for one field
+    price_data:
+        returns a single-column 'price' frame for the backtesters
+    """
+
+    def __init__(self, path, cache_size=CACHE_SIZE):
+        self.path = path
+        self.cache_size = cache_size
+        self.conn = sqlite3.connect(
+            f'file:{os.path.abspath(path)}?mode=ro', uri=True,
+            check_same_thread=False
+        )
+        self.lock = threading.Lock()
+        self.cache = OrderedDict()
+        self.version = None
+        self.hits = 0
+        self.misses = 0
+
+    def _check_version(self):
+        # data_version changes whenever another connection commits
+        version = self.conn.execute('PRAGMA data_version').fetchone()[0]
+        if version != self.version:
+            self.cache.clear()
+            self.version = version
+
+    def symbols(self):
+        """Returns the stored symbols."""
+        with self.lock:
+            rows = self.conn.execute(
+                'SELECT DISTINCT symbol FROM stock_data ORDER BY symbol')
+            return [row[0] for row in rows]
+
+    def read(self, symbol, start=None, end=None, field='close'):
+        """Returns (dates, values) of symbol within [start, end].
+
+        Uses a range scan on the (symbol, date) primary key. dates is a
+        datetime64[ns] array; both arrays are cached and read-only.
+        """
+        if field not in FIELDS:
+            raise ValueError(f'Field {field} not in {FIELDS}.')
+        key = (symbol, field, _bound(start), _bound(end, upper=True))
+        with self.lock:
+            self._check_version()
+            if key in self.cache:
+                self.cache.move_to_end(key)
+                self.hits += 1
+                return self.cache[key]
+            self.misses += 1
+            query = (f'SELECT date, {field} FROM stock_data '
+                     'WHERE symbol = ? AND date >= ? AND date <= ? '
+                     'ORDER BY date')
+            rows = self.conn.execute(
+                query, (symbol, key[2] or '', key[3] or '9999-12-31')
+            ).fetchall()
+            dates = np.array([row[0] for row in rows], dtype='datetime64[ns]')
+            values = np.array([row[1] for row in rows], dtype=np.float64)
+            dates.flags.writeable = False
+            values.flags.writeable = False
+            self.cache[key] = dates, values
+            if len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+            return dates, values
+
+    def read_panel(self, symbols, start=None, end=None, field='close'):
+        """Returns a (dates x symbols) frame; missing bars are NaN."""
+        arrays = [self.read(symbol, start, end, field) for symbol in symbols]
+        dates = np.unique(np.concatenate([a[0] for a in arrays]))
+        panel = np.full((len(dates), len(symbols)), np.nan)
+        for i, (d, v) in enumerate(arrays):
+            panel[np.searchsorted(dates, d), i] = v
+        return pd.DataFrame(panel, index=pd.DatetimeIndex(dates, name='Date'),
+                            columns=list(symbols))
+
+    def price_data(self, symbol, start=None, end=None, field='close'):
+        """Returns a 'price' frame for symbol (bars without price dropped)."""
+        dates, values = self.read(symbol, start, end, field)
+        keep = ~np.isnan(values)
+        return pd.DataFrame({'price': values[keep]},
+                            index=pd.DatetimeIndex(dates[keep], name='Date'))
+
+
+def get_reader(path):
+    """Returns the reader of this process for path (one connection each)."""
+    key = os.path.abspath(path)
+    hit = _readers.get(key)
+    if hit is None or hit[0] != os.getpid():
+        # connections must not be shared with forked children
+        hit = os.getpid(), MarketDataReader(path)
+        _readers[key] = hit
+    return hit[1]
+
+
+if __name__ == '__main__':
+    reader = get_reader('02.StoreData/market_data.sqlite')
+    symbols = reader.symbols()
+    print(symbols)
+    print(reader.read_panel(symbols).tail())
@@ -0,0 +1,228 @@
+"""Content-addressed on-disk cache of fitted models.
+
+The AI backtesters refit identical models on identical data every time a
+scenario is rerun. ``fit_model`` asks this cache instead: a fitted model
+(regression coefficients or a scikit-learn estimator) is pickled under a
+SHA-256 key of the symbol, the training window, the number of lags, the
+model type and hyperparameters and a fingerprint of the training data,
+so any change to one of them is a different entry and nothing stale is
+ever loaded.
+
+Entries are files ``<symbol>_<key>.pkl`` in ``MODEL_DIR``; their mtime is
+refreshed on every load and the least recently used files are deleted
+once the directory holds more than ``MAX_BYTES``. ``PYALGO_MODEL_CACHE=0``
+switches the cache off for all backtesters.
+
+Invalidation from the command line::
+
+    python model_cache.py clear [SYMBOL ...]
+    python model_cache.py stats
+"""
+
+import hashlib
+import json
+import os
+import pickle
+import sys
+import threading
+from urllib.parse import quote
+
+import numpy as np
+
+MODEL_DIR = os.environ.get(
+    'PYALGO_MODEL_DIR',
+    os.path.join(os.path.expanduser('~'), '.pyalgo_models')
+)
+MAX_BYTES = 512 * 2**20  # bytes on disk before LRU eviction
+ENABLED = os.environ.get('PYALGO_MODEL_CACHE', '1') not in ('', '0')
+
+
+def fingerprint(*arrays):
+    """Returns a SHA-1 hex digest of the contents of arrays."""
+    digest = hashlib.sha1()
+    for values in arrays:
+        values = np.ascontiguousarray(values)
+        digest.update(str((values.dtype, values.shape)).encode())
+        digest.update(values.tobytes())
+    return digest.hexdigest()
+
+
+def _prefix(symbol):
+    """File name prefix of the entries of symbol ('_' only as separator)."""
+    return quote(symbol, safe='').replace('_', '%5F') + '_'
+
+
+class ModelCache(object):
+    """On-disk LRU cache of fitted models.
+
+    Attributes
+    ==========
+    path: str
+        directory holding the pickled models
+    max_bytes: int
+        maximum size of all entries on disk
+
+    Methods
+    =======
+    key:
+        returns the content address of a fit
+    get:
+        returns a fitted model, fitting and storing it on a miss
+    invalidate:
+        deletes all entries or those of some symbols
+    stats:
+        returns hit/miss/eviction counters and the disk usage
+    """
+
+    def __init__(self, path=MODEL_DIR, max_bytes=MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def key(self, symbol, start, end, lags, model, params, data):
+        """Returns the SHA-256 key of a fit.
+
+        Parameters
+        ==========
+        symbol: str
+            symbol the model is fitted for
+        start, end: str or pd.Timestamp
+            first and last date of the training window
+        lags: int
+            number of lagged returns used as features
+        model: str
+            model type
+        params: dict
+            hyperparameters (and library versions) of the model
+        data: str
+            fingerprint of the training data
+        """
+        parts = {'symbol': symbol, 'start': str(start), 'end': str(end),
+                 'lags': int(lags), 'model': model,
+                 'params': sorted((k, repr(v)) for k, v in params.items()),
+                 'data': data}
+        return hashlib.sha256(
+            json.dumps(parts, sort_keys=True).encode()).hexdigest()
+
+    def _file(self, symbol, key):
+        return os.path.join(self.path, f'{_prefix(symbol)}{key}.pkl')
+
+    def _entries(self):
+        """Lists (mtime, size, path) of all entries, oldest first."""
+        if not os.path.isdir(self.path):
+            return []
+        entries = []
+        for name in os.listdir(self.path):
+            if name.endswith('.pkl'):
+                path = os.path.join(self.path, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((st.st_mtime_ns, st.st_size, path))
+        return sorted(entries)
+
+    def get(self, symbol, key, fit):
+        """Returns the model stored under key or fit() (stored on a miss)."""
+        path = self._file(symbol, key)
+        try:
+            with open(path, 'rb') as f:
+                model = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            pass
+        else:
+            os.utime(path)
+            with self.lock:
+                self.hits += 1
+            return model
+        with self.lock:
+            self.misses += 1
+        model = fit()
+        os.makedirs(self.path, exist_ok=True)
+        tmp = f'{path}.{os.getpid()}.tmp'
+        with open(tmp, 'wb') as f:
+            pickle.dump(model, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, path)
+        self._evict()
+        return model
+
+    def _evict(self):
+        entries = self._entries()
+        nbytes = sum(size for _, size, _ in entries)
+        # the newest entry is always kept
+        for _, size, path in entries[:-1]:
+            if nbytes <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            nbytes -= size
+            with self.lock:
+                self.evictions += 1
+
+    def invalidate(self, symbols=None):
+        """Deletes the entries of symbols (default: all); returns their
+        number."""
+        prefixes = None
+        if symbols is not None:
+            prefixes = tuple(_prefix(s) for s in symbols)
+        removed = 0
+        for _, _, path in self._entries():
+            if prefixes is None or os.path.basename(path).startswith(prefixes):
+                os.remove(path)
+                removed += 1
+        return removed
+
+    def stats(self):
+        """Returns the counters and the disk usage."""
+        entries = self._entries()
+        requests = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / requests if requests else 0.0,
+            'evictions': self.evictions,
+            'entries': len(entries),
+            'nbytes': sum(size for _, size, _ in entries),
+            'max_bytes': self.max_bytes,
+        }
+
+
+_cache = ModelCache()
+
+
+def cached_fit(symbol, start, end, lags, model, params, data, fit):
+    """Returns fit() through the process-wide cache (see ModelCache.key)."""
+    if not ENABLED:
+        return fit()
+    key = _cache.key(symbol, start, end, lags, model, params, data)
+    return _cache.get(symbol, key, fit)
+
+
+def invalidate(symbols=None):
+    """Deletes cached models of symbols (default: all)."""
+    return _cache.invalidate(symbols)
+
+
+def cache_stats():
+    """Returns the statistics of the process-wide cache."""
+    return _cache.stats()
+
+
+def set_max_bytes(max_bytes):
+    """Changes the disk budget (bytes) of the process-wide cache."""
+    _cache.max_bytes = max_bytes
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == 'clear':
+        removed = invalidate(sys.argv[2:] or None)
+        print(f'removed {removed} cached models from {_cache.path}')
+    elif len(sys.argv) > 1 and sys.argv[1] == 'stats':
+        print(cache_stats())
+    else:
+        print('Enter clear [SYMBOL ...] or stats')
@@ -0,0 +1,104 @@
+"""Least-squares fits from the normal equations X'X b = X'y.
+
+The regression backtesters only ever need the Gram matrix X'X and the
+moment vector X'y of a design matrix with a handful of columns. Both are
+(lags x lags) and (lags,) no matter how many bars the window holds, so
+
+* a rolling refit updates them as bars enter and leave the window, O(L^2)
+  per bar instead of a new O(W L^2) lstsq on every window, and
+* exponential forgetting multiplies them by a factor < 1 before every new
+  bar, so older bars fade out instead of dropping out abruptly.
+
+The coefficients are the solutions of the (batched) L x L systems.
+"""
+
+import numpy as np
+
+
+def gram(features, target, weights=None):
+    """Returns X'X and X'y of features (bars x lags) and target (bars)."""
+    if weights is not None:
+        target = weights * target
+        xx = (features * weights[:, None]).T @ features
+    else:
+        xx = features.T @ features
+    return xx, features.T @ target
+
+
+def _solve(xx, xy):
+    try:
+        return np.linalg.solve(xx, xy[..., None])[..., 0]
+    except np.linalg.LinAlgError:
+        # a rank-deficient system (e.g. a window of zero returns or
+        # duplicate features): the minimum-norm least-squares solution,
+        # as np.linalg.lstsq gives it
+        return (np.linalg.pinv(xx, hermitian=True) @ xy[..., None])[..., 0]
+
+
+def solve(xx, xy, counts=None):
+    """Solves the normal equations, for one or a stack of Gram matrices.
+
+    Systems of windows with fewer than lags bars (counts) have no unique
+    solution and get zero coefficients, i.e. no position. Singular
+    systems get the least-squares solution of minimum norm.
+    """
+    xx, xy = np.asarray(xx), np.asarray(xy)
+    lags = xy.shape[-1]
+    if counts is None:
+        return _solve(xx, xy)
+    reg = np.zeros(xy.shape)
+    ok = np.asarray(counts) >= lags
+    if ok.any():
+        reg[ok] = _solve(xx[ok], xy[ok])
+    return reg
+
+
+def rolling_gram(features, target, rows, window, first=0, forgetting=1.0):
+    """Gram matrices of the trailing windows of a range of rows.
+
+    For every row t in rows the window holds the rows [t - window, t)
+    (not before first) with weight forgetting ** (t - 1 - s) for row s,
+    so the regression for bar t only uses bars before it.
+
+    Parameters
+    ==========
+    features: np.ndarray
+        (bars x lags) design matrix of the full history
+    target: np.ndarray
+        target of every row of features
+    rows: slice
+        rows to compute the windows for
+    window: int
+        maximum number of bars in a window
+    first: int
+        first row of features without NaN
+    forgetting: float
+        factor in (0, 1] by which older bars are down-weighted per bar
+
+    Returns
+    =======
+    tuple
+        X'X (rows x lags x lags), X'y (rows x lags) and the number of
+        bars in every window
+    """
+    start, stop = rows.start, max(rows.start, rows.stop)
+    lags = features.shape[1]
+    xx = np.empty((stop - start, lags, lags))
+    xy = np.empty((stop - start, lags))
+    counts = np.empty(stop - start, dtype=int)
+    lo = max(first, start - window)
+    weights = forgetting ** np.arange(start - lo)[::-1]
+    g, b = gram(features[lo:start], target[lo:start], weights)
+    dropped = forgetting ** window  # weight of a row leaving the window
+    for k, t in enumerate(range(start, stop)):
+        xx[k], xy[k], counts[k] = g, b, t - lo
+        # bar t enters the window of bar t + 1
+        x = features[t]
+        g = forgetting * g + np.outer(x, x)
+        b = forgetting * b + x * target[t]
+        if t + 1 - lo > window:
+            x = features[lo]
+            g -= dropped * np.outer(x, x)
+            b -= dropped * x * target[lo]
+            lo += 1
+    return xx, xy, counts
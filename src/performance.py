@@ -0,0 +1,158 @@
+"""Performance records and lazily built results frames of the vectorized
+backtesters.
+
+``run_strategy`` computes the strategy returns on NumPy arrays and only
+exponentiates the final cumulative sums. With ``metrics_only=True`` it
+returns the unrounded ``Metrics`` record (absolute and relative
+performance, Sharpe and Sortino ratio, maximum drawdown, hit rate and
+turnover) instead of the rounded (aperf, operf) tuple; the event-based
+backtesters return the same record from ``close_out``. In both cases the
+``results`` frame (positions, strategy returns, creturns and cstrategy)
+is only built when it is first accessed, e.g. by ``plot_results``, so
+optimizers and sweeps never pay for it.
+
+Momentum, mean-reversion and the AI backtesters also accept a vector of
+transaction costs: positions and trades are computed once and the costs
+are deducted along an extra axis, one column per cost level.
+"""
+
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+PERIODS = 252  # bars per year, to annualize ratios and turnover
+
+Metrics = namedtuple('Metrics', ['aperf', 'operf', 'sharpe', 'sortino',
+                                 'max_drawdown', 'hit_rate', 'turnover'])
+
+
+def metrics(returns, strategy, amount=1, position=None, periods=PERIODS):
+    """Returns the Metrics of strategy against the market.
+
+    All statistics are derived from one cumulative sum and a few sums over
+    the bar axis (axis 0), so 2D inputs score every column (parameter set,
+    cost level or symbol) at once.
+
+    Parameters
+    ==========
+    returns: np.ndarray
+        log returns of the market (bars or bars x columns)
+    strategy: np.ndarray
+        log returns of the strategy (bars or bars x columns); NaN entries
+        are skipped as in the cumulative sums of the results frame
+    amount: int, float
+        amount invested at the beginning
+    position: np.ndarray
+        positions (exposure) per bar, for the turnover
+    periods: int
+        bars per year
+
+    Returns
+    =======
+    Metrics
+        aperf, operf, annualized Sharpe and Sortino ratio (of the log
+        returns, target 0), maximum drawdown (0.25 = 25% below the running
+        peak), hit rate (share of positive returns among the nonzero ones)
+        and annual turnover (sum of absolute position changes per year);
+        scalars for 1D and arrays for 2D inputs
+    """
+    strategy = np.asarray(strategy, dtype=float)
+    level = np.nancumsum(strategy, axis=0)
+    aperf = amount * np.exp(level[-1])
+    operf = aperf - amount * np.exp(np.nancumsum(returns, axis=0)[-1])
+    valid = ~np.isnan(strategy)
+    rets = np.where(valid, strategy, 0.0)
+    bars = valid.sum(axis=0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean = level[-1] / bars
+        var = ((rets ** 2).sum(axis=0) - bars * mean ** 2) / (bars - 1)
+        downside = np.sqrt((np.minimum(rets, 0) ** 2).sum(axis=0) / bars)
+        sharpe = np.where(var > 0, np.sqrt(periods) * mean / np.sqrt(var),
+                          np.nan)
+        sortino = np.where(downside > 0, np.sqrt(periods) * mean / downside,
+                           np.nan)
+        hit_rate = (rets > 0).sum(axis=0) / (rets != 0).sum(axis=0)
+    # the initial amount is the first peak
+    peak = np.maximum.accumulate(np.maximum(level, 0), axis=0)
+    max_drawdown = 1 - np.exp((level - peak).min(axis=0))
+    if position is None:
+        turnover = np.nan
+    else:
+        position = np.nan_to_num(np.asarray(position, dtype=float))
+        changes = np.abs(np.diff(position, axis=0)).sum(axis=0)
+        turnover = changes * periods / len(position)
+    return Metrics(aperf, operf, sharpe[()], sortino[()], max_drawdown,
+                   hit_rate, turnover)
+
+
+def deduct_costs(strategy, trades, tc):
+    """Subtracts tc from strategy on the bars with a trade.
+
+    For a vector of cost levels the result has a trailing cost axis
+    (bars x levels); positions and trades are shared by all levels.
+    """
+    tc = np.asarray(tc, dtype=float)
+    if tc.ndim:
+        return strategy[:, None] - trades[:, None] * tc[None, :]
+    return strategy - tc * trades
+
+
+def report(result, tc=None, metrics_only=False):
+    """Converts Metrics into the return value of run_strategy.
+
+    Returns the rounded (aperf, operf) tuple for a scalar tc and a frame
+    with one row per cost level for a vector tc; metrics_only returns all
+    metrics unrounded (the Metrics record itself for a scalar tc).
+    """
+    if np.ndim(tc):
+        table = pd.DataFrame(
+            result._asdict(), index=pd.Index(np.asarray(tc, dtype=float), name='tc')
+        )
+        return table if metrics_only else table[['aperf', 'operf']].round(2)
+    if metrics_only:
+        return result
+    return round(result.aperf, 2), round(result.operf, 2)
+
+
+def results_frame(base, amount, market='return', tc=None, **columns):
+    """Returns a copy of base with columns added and the cumulative
+    performance of the market (creturns) and the strategy (cstrategy).
+
+    For a vector tc the 2D strategy column is split into one strategy_<tc>
+    and one cstrategy_<tc> column per cost level.
+    """
+    data = base.copy()
+    for name, values in columns.items():
+        if name == 'strategy' and np.ndim(tc):
+            for i, level in enumerate(tc):
+                data[f'strategy_{level:g}'] = values[:, i]
+        else:
+            data[name] = values
+    data['creturns'] = amount * np.exp(data[market].cumsum())
+    for name in [col for col in data.columns if col.startswith('strategy')]:
+        data['c' + name] = amount * np.exp(data[name].cumsum())
+    return data
+
+
+class LazyResults(object):
+    """Descriptor for the results attribute of a backtester.
+
+    A callable assigned to it is called on first access and replaced by
+    its return value; any other value is stored as is.
+    """
+
+    def __set_name__(self, owner, name):
+        self.name = '_' + name
+
+    def __get__(self, obj, objtype=None):
+        if obj is None:
+            return self
+        value = obj.__dict__.get(self.name)
+        if callable(value):
+            value = value()
+            obj.__dict__[self.name] = value
+        return value
+
+    def __set__(self, obj, value):
+        obj.__dict__[self.name] = value
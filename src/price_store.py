@@ -0,0 +1,139 @@
+"""Memory-mapped, symbol-indexed price store.
+
+A store is a directory with three files:
+
+``prices.f8``
+    float64 matrix of shape (symbols, dates); every symbol is one
+    contiguous row
+``dates.i8``
+    shared int64 date index (nanoseconds since the epoch)
+``store.json``
+    symbol names, number of dates and the name of the index
+
+Both binary files are opened with ``np.memmap`` in read-only mode, so any
+number of processes backtesting the same universe share a single
+page-cached copy. Date-range selection is a binary search on the date
+index and returns views into the mapping, never copies.
+"""
+
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+
+def write_store(path, raw):
+    """Writes the frame raw (dates x symbols) as a price store to path.
+
+    Files are written under temporary names and then moved into place, so
+    readers that already mapped an older version are not affected.
+    """
+    os.makedirs(path, exist_ok=True)
+    dates = raw.index.values.astype('datetime64[ns]').view('int64')
+    prices = np.ascontiguousarray(raw.values.T, dtype=np.float64)
+    for name, values in (('dates.i8', dates), ('prices.f8', prices)):
+        tmp = os.path.join(path, name + '.tmp')
+        values.tofile(tmp)
+        os.replace(tmp, os.path.join(path, name))
+    meta = {'symbols': list(raw.columns), 'length': len(dates),
+            'index_name': raw.index.name}
+    tmp = os.path.join(path, 'store.json.tmp')
+    with open(tmp, 'w') as f:
+        json.dump(meta, f)
+    os.replace(tmp, os.path.join(path, 'store.json'))
+
+
+class PriceStore(object):
+    """Read-only view on a price store written by write_store.
+
+    Attributes
+    ==========
+    path: str
+        directory of the store
+    symbols: list
+        symbol names in storage order
+    dates: np.memmap
+        int64 date index
+    prices: np.memmap
+        float64 matrix (symbols x dates)
+
+    Methods
+    =======
+    bounds:
+        returns the index range for a date range (binary search)
+    select:
+        returns dates and prices of one symbol as zero-copy views
+    price_data:
+        returns a single-column 'price' frame backed by the mapping
+    panel_data:
+        returns the prices of several symbols (dates x symbols)
+    frame:
+        returns the full data set as a frame backed by the mapping
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, 'store.json')) as f:
+            meta = json.load(f)
+        self.symbols = meta['symbols']
+        self.index_name = meta['index_name']
+        self.positions = {sym: i for i, sym in enumerate(self.symbols)}
+        length = meta['length']
+        self._index = None
+        self.dates = np.memmap(os.path.join(path, 'dates.i8'),
+                               dtype=np.int64, mode='r', shape=(length,))
+        self.prices = np.memmap(os.path.join(path, 'prices.f8'),
+                                dtype=np.float64, mode='r',
+                                shape=(len(self.symbols), length))
+
+    def __getstate__(self):
+        # worker processes re-open the mapping instead of pickling arrays
+        return {'path': self.path}
+
+    def __setstate__(self, state):
+        self.__init__(state['path'])
+
+    def bounds(self, start=None, end=None):
+        """Returns (i, j) such that dates[i:j] lies within [start, end].
+
+        Uses a binary search on the sorted date index with the same
+        (partial string) semantics as ``.loc[start:end]``.
+        """
+        if self._index is None:
+            self._index = self.index(self.dates)
+        sl = self._index.slice_indexer(start, end)
+        i = 0 if sl.start is None else int(sl.start)
+        j = len(self.dates) if sl.stop is None else int(sl.stop)
+        return i, j
+
+    def select(self, symbol, start=None, end=None):
+        """Returns (dates, prices) of symbol within [start, end] as views."""
+        i, j = self.bounds(start, end)
+        return self.dates[i:j], self.prices[self.positions[symbol], i:j]
+
+    def index(self, dates):
+        return pd.DatetimeIndex(np.asarray(dates).view('datetime64[ns]'),
+                                name=self.index_name)
+
+    def price_data(self, symbol, start=None, end=None):
+        """Returns a 'price' frame for symbol that shares memory with the
+        mapping; new columns can be added, the prices must not be changed.
+        """
+        dates, prices = self.select(symbol, start, end)
+        return pd.DataFrame({'price': np.asarray(prices)},
+                            index=self.index(dates), copy=False)
+
+    def panel_data(self, symbols, start=None, end=None):
+        """Returns a (dates x symbols) frame; one copy of the selected rows."""
+        i, j = self.bounds(start, end)
+        rows = [self.positions[symbol] for symbol in symbols]
+        return pd.DataFrame(self.prices[rows, i:j].T,
+                            index=self.index(self.dates[i:j]),
+                            columns=list(symbols))
+
+    def frame(self):
+        """Returns the full data set (dates x symbols) without copying."""
+        return pd.DataFrame(np.asarray(self.prices).T,
+                            index=self.index(self.dates),
+                            columns=self.symbols, copy=False)
@@ -0,0 +1,193 @@
+"""Bootstrap robustness checks for backtest results.
+
+A single backtest yields one path of strategy returns. This module
+resamples that path thousands of times and reports how final wealth,
+Sharpe ratio and maximum drawdown are distributed across the resamples:
+
+* ``stationary``: stationary bootstrap (Politis/Romano), blocks of
+  geometrically distributed length with mean ``block``, wrapping around
+  the end of the series
+* ``block``: moving block bootstrap with blocks of fixed length ``block``
+
+Blocks keep the short-term dependence (volatility clustering, position
+runs) that an i.i.d. bootstrap would destroy. Resamples are drawn as one
+(samples x bars) index array per chunk; all statistics are batched NumPy
+reductions over the bar axis and the (samples x bars) arrays alive at
+once hold at most ``chunk`` cells together. The same seed always gives
+the same draws (for a given chunk).
+
+Input is the ``strategy`` column of any vectorized backtester's
+``results`` (or another column, e.g. ``strategy_0.001`` of a run with
+several transaction costs)::
+
+    mombt.run_strategy(momentum=3)
+    draws = bootstrap(mombt.results, n_samples=10000, seed=42)
+    print(summarize(draws, mombt.results, amount=mombt.amount))
+"""
+
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+CHUNK = 2**22  # max. cells of all (samples x bars) arrays held at once
+# (samples x bars) arrays alive at the peak of a chunk: the stationary
+# draw holds a bit over 5 (flags, starts, origins and temporaries)
+LIVE_ARRAYS = 6
+PERIODS = 252  # bars per year, to annualize the Sharpe ratio
+METHODS = ('stationary', 'block')
+
+
+def _log_returns(returns, column='strategy'):
+    """Returns the strategy log returns as a float array without NaN."""
+    if isinstance(returns, pd.DataFrame):
+        returns = returns[column]
+    returns = np.asarray(returns, dtype=float)
+    return returns[~np.isnan(returns)]
+
+
+def stationary_indices(rng, size, bars, block):
+    """Draws (size x bars) indices of the stationary bootstrap.
+
+    Every bar starts a new block with probability 1 / block, otherwise
+    the block continues with the next bar (circularly).
+    """
+    new_block = rng.random((size, bars)) < 1.0 / block
+    new_block[:, 0] = True
+    starts = rng.integers(0, bars, (size, bars))
+    steps = np.arange(bars)
+    # position of the bar that started the current block
+    origin = np.maximum.accumulate(np.where(new_block, steps, 0), axis=1)
+    begin = np.take_along_axis(starts, origin, axis=1)
+    return (begin + steps - origin) % bars
+
+
+def block_indices(rng, size, bars, block):
+    """Draws (size x bars) indices of the moving block bootstrap."""
+    block = min(block, bars)
+    blocks = -(-bars // block)
+    starts = rng.integers(0, bars - block + 1, (size, blocks))
+    indices = starts[:, :, None] + np.arange(block)
+    return indices.reshape(size, -1)[:, :bars]
+
+
+def path_metrics(paths, amount=1, periods=PERIODS):
+    """Final wealth, Sharpe ratio and maximum drawdown of every row.
+
+    Parameters
+    ==========
+    paths: np.ndarray
+        (samples x bars) log returns
+    amount: int, float
+        amount invested at the beginning
+    periods: int
+        bars per year (annualization of the Sharpe ratio)
+
+    Returns
+    =======
+    tuple
+        three arrays of length samples; the drawdown is the largest
+        relative loss from a running peak (0.25 = 25%)
+    """
+    level = np.cumsum(paths, axis=1)
+    final_wealth = amount * np.exp(level[:, -1])
+    std = paths.std(axis=1, ddof=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        sharpe = np.sqrt(periods) * paths.mean(axis=1) / std
+    sharpe[std == 0] = np.nan
+    # the initial amount is the first peak
+    peak = np.maximum.accumulate(np.maximum(level, 0), axis=1)
+    max_drawdown = 1 - np.exp((level - peak).min(axis=1))
+    return final_wealth, sharpe, max_drawdown
+
+
+def bootstrap(returns, n_samples=10000, block=20, method='stationary',
+              amount=1, periods=PERIODS, seed=None, chunk=CHUNK,
+              column='strategy'):
+    """Bootstraps the distribution of final wealth, Sharpe ratio and
+    maximum drawdown of a strategy.
+
+    Parameters
+    ==========
+    returns: pd.DataFrame, pd.Series or np.ndarray
+        strategy log returns or a results frame (see column); NaN entries
+        are dropped
+    n_samples: int
+        number of resampled paths
+    block: int
+        (mean) block length in bars
+    method: str
+        'stationary' or 'block'
+    amount: int, float
+        amount invested at the beginning
+    periods: int
+        bars per year (annualization of the Sharpe ratio)
+    seed: int or np.random.Generator
+        seed for reproducible draws
+    chunk: int
+        max. number of cells of all (samples x bars) arrays held in memory
+        at once
+    column: str
+        column of a results frame with the strategy log returns
+
+    Returns
+    =======
+    pd.DataFrame
+        final_wealth, sharpe and max_drawdown, one row per resample
+    """
+    if method not in METHODS:
+        raise ValueError(f'Method {method} not in {METHODS}.')
+    returns = _log_returns(returns, column)
+    bars = len(returns)
+    if bars < 2:
+        raise ValueError('At least two returns are needed.')
+    draw = stationary_indices if method == 'stationary' else block_indices
+    rng = np.random.default_rng(seed)
+    rows = max(1, chunk // (LIVE_ARRAYS * bars))
+    final_wealth = np.empty(n_samples)
+    sharpe = np.empty(n_samples)
+    max_drawdown = np.empty(n_samples)
+    for i in range(0, n_samples, rows):
+        size = min(rows, n_samples - i)
+        # no name keeps the paths of a chunk alive while the next is drawn
+        final_wealth[i:i + size], sharpe[i:i + size], \
+            max_drawdown[i:i + size] = path_metrics(
+                returns[draw(rng, size, bars, block)], amount, periods)
+    return pd.DataFrame({'final_wealth': final_wealth, 'sharpe': sharpe,
+                         'max_drawdown': max_drawdown})
+
+
+def summarize(draws, returns=None, amount=1, periods=PERIODS,
+              quantiles=(0.05, 0.25, 0.5, 0.75, 0.95), column='strategy'):
+    """Summarizes bootstrap draws.
+
+    Returns quantiles and the mean of every statistic, the observed values
+    of the original path (if returns are given; column selects the column
+    of a results frame) and the probability of ending below the initial
+    amount.
+    """
+    table = draws.quantile(list(quantiles))
+    table.index = [f'q{q:g}' for q in quantiles]
+    table.loc['mean'] = draws.mean()
+    if returns is not None:
+        observed = path_metrics(_log_returns(returns, column)[None, :],
+                                amount, periods)
+        table.loc['observed'] = [values[0] for values in observed]
+    table.loc['p_loss'] = [(draws['final_wealth'] < amount).mean(),
+                           np.nan, np.nan]
+    return table
+
+
+if __name__ == '__main__':
+    sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                 '03.VectorizedBackTesting'))
+    from momentum_backtesting import MomVectorBacktester
+
+    mombt = MomVectorBacktester('XAU=', '2010-1-1', '2020-12-31', 10000, 0.001)
+    mombt.run_strategy(momentum=3)
+    for method in METHODS:
+        draws = bootstrap(mombt.results, 10000, method=method,
+                          amount=mombt.amount, seed=42)
+        print(method)
+        print(summarize(draws, mombt.results, amount=mombt.amount))
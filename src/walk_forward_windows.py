@@ -0,0 +1,27 @@
+"""Train and test windows of the walk-forward backtests.
+
+Shared by the walk-forward optimization of the vectorized backtesters
+(``walk_forward.py``) and the walk-forward refits of the machine
+learning backtesters (``logistic_reg_backtester.py``).
+"""
+
+
+def windows(bars, train, test, anchored=False, first=0):
+    """Lists the (train_start, test_start, test_end) positions of
+    consecutive out-of-sample windows; the last one may be shorter.
+
+    Parameters
+    ==========
+    bars: int
+        number of bars (or rows) in total
+    train, test: int
+        number of bars in the in-sample and out-of-sample windows
+    anchored: bool
+        if True, in-sample windows always start at the first bar
+    first: int
+        first usable bar (e.g. the first row with complete features)
+    """
+    return [
+        (first if anchored else start - train, start, min(start + test, bars))
+        for start in range(first + train, bars, test)
+    ]
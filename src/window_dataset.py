@@ -0,0 +1,226 @@
+"""Streaming mini-batches of (window, label) pairs for the deep learning
+workflow.
+
+A sample is the window of the ``window`` returns before bar t and the
+label of bar t (its direction, sign or return). Instead of a lagged
+feature matrix of every sample, the dataset keeps the return series
+(NumPy arrays, views or read-only memmaps of a feature store) and a
+``sliding_window_view`` over each; only the windows of the current batch
+are gathered into a new array.
+
+Shuffling works on blocks of consecutive samples: the blocks of an epoch
+are permuted, ``buffer`` blocks at a time are pooled and their samples
+shuffled together, so an epoch needs O(samples / block) memory instead
+of a permutation of all samples. Batches are prepared by a background
+thread while the model trains on the previous one. Everything runs in
+NumPy on the CPU::
+
+    train = from_store(['EUR=', 'GDX'], window=5, end='2017-12-31')
+    model.fit(train.batches(epochs=None), steps_per_epoch=len(train),
+              epochs=25)
+"""
+
+import queue
+import threading
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+from feature_store import update_features
+
+LABELS = ('direction', 'sign', 'return')
+_DONE = object()
+
+
+def _first_finite(values, chunk=4096):
+    """Returns the position of the first finite value (len if none)."""
+    for i in range(0, len(values), chunk):
+        finite = np.flatnonzero(np.isfinite(values[i:i + chunk]))
+        if len(finite):
+            return i + int(finite[0])
+    return len(values)
+
+
+class WindowDataset(object):
+    """Shuffled (window, label) mini-batches over return series.
+
+    Attributes
+    ==========
+    series: list
+        1D return series (arrays or memmaps); leading NaN are skipped
+    window: int
+        number of returns per window
+    batch_size: int
+        number of samples per batch
+    label: str
+        'direction' (1 if the return is positive, else 0), 'sign' or
+        'return'
+    shuffle: bool
+        shuffle the samples of every epoch
+    order: str
+        'lags' (most recent return first, as lag_1, lag_2, ...) or 'time'
+    mu, std: float
+        the windows are standardized as (window - mu) / std
+    seed: int
+        seed of the shuffling
+    block, buffer: int
+        samples per shuffling block and blocks shuffled together
+    prefetch: int
+        number of batches prepared ahead
+
+    Methods
+    =======
+    batches:
+        yields the (x, y) batches of one or more epochs
+    arrays:
+        returns all windows and labels (for small evaluation sets)
+    moments:
+        returns mean and standard deviation of the returns
+    """
+
+    def __init__(self, series, window, batch_size=256, label='direction',
+                 shuffle=True, order='lags', mu=0.0, std=1.0, seed=None,
+                 block=1024, buffer=64, prefetch=4):
+        if label not in LABELS:
+            raise ValueError(f'Label {label} not in {LABELS}.')
+        self.series = list(series)
+        self.window = window
+        self.batch_size = batch_size
+        self.label = label
+        self.shuffle = shuffle
+        self.order = order
+        self.mu = mu
+        self.std = std
+        self.block = block
+        self.buffer = buffer
+        self.prefetch = prefetch
+        self.rng = np.random.default_rng(seed)
+        # samples of series k are the bars starts[k] ... len - 1
+        self.starts = np.array([_first_finite(s) + window
+                                for s in self.series], dtype=np.int64)
+        counts = np.maximum(
+            0, np.array([len(s) for s in self.series]) - self.starts)
+        self.ends = np.cumsum(counts)
+        self.begins = self.ends - counts
+        self.samples = int(self.ends[-1]) if len(counts) else 0
+        self.views = [sliding_window_view(s, window) if len(s) >= window
+                      else None for s in self.series]
+
+    def __len__(self):
+        return -(-self.samples // self.batch_size)
+
+    def __iter__(self):
+        return self.batches()
+
+    def _epoch(self):
+        """Yields the sample ids of the batches of one epoch."""
+        if not self.shuffle:
+            for i in range(0, self.samples, self.batch_size):
+                yield np.arange(i, min(i + self.batch_size, self.samples))
+            return
+        blocks = self.rng.permutation(-(-self.samples // self.block))
+        pending = np.empty(0, dtype=np.int64)
+        for i in range(0, len(blocks), self.buffer):
+            ids = (blocks[i:i + self.buffer, None] * self.block +
+                   np.arange(self.block)).ravel()
+            ids = np.concatenate((pending, ids[ids < self.samples]))
+            self.rng.shuffle(ids)
+            full = len(ids) - len(ids) % self.batch_size
+            for j in range(0, full, self.batch_size):
+                yield ids[j:j + self.batch_size]
+            pending = ids[full:]
+        if len(pending):
+            yield pending
+
+    def gather(self, ids):
+        """Returns the windows (samples x window, float32) and labels of
+        sample ids."""
+        k = np.searchsorted(self.ends, ids, 'right')
+        t = self.starts[k] + ids - self.begins[k]
+        x = np.empty((len(ids), self.window), dtype=np.float32)
+        y = np.empty(len(ids), dtype=np.float32)
+        for s in np.unique(k):
+            sel = k == s
+            # view row i holds the returns of the bars i ... i + window - 1
+            x[sel] = self.views[s][t[sel] - self.window]
+            y[sel] = self.series[s][t[sel]]
+        if self.order == 'lags':
+            x = x[:, ::-1]
+        if self.mu != 0.0 or self.std != 1.0:
+            x = (x - self.mu) / self.std
+        if self.label == 'direction':
+            y = (y > 0).astype(np.float32)
+        elif self.label == 'sign':
+            y = np.sign(y)
+        return np.ascontiguousarray(x), y
+
+    def batches(self, epochs=1):
+        """Yields the (x, y) batches of epochs epochs (None: endless),
+        prepared by a background thread."""
+        batches = queue.Queue(self.prefetch)
+        stop = threading.Event()
+
+        def put(item):
+            while not stop.is_set():
+                try:
+                    batches.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        def produce():
+            try:
+                epoch = 0
+                while epochs is None or epoch < epochs:
+                    for ids in self._epoch():
+                        if not put(self.gather(ids)):
+                            return
+                    epoch += 1
+            except Exception as exc:
+                put(exc)
+            put(_DONE)
+
+        producer = threading.Thread(target=produce, daemon=True)
+        producer.start()
+        try:
+            while True:
+                item = batches.get()
+                if item is _DONE:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            stop.set()
+            producer.join()
+
+    def arrays(self):
+        """Returns the windows and labels of all samples in order."""
+        return self.gather(np.arange(self.samples))
+
+    def moments(self, chunk=2**20):
+        """Returns mean and standard deviation of the returns of all
+        samples' windows (one streaming pass)."""
+        n, total, squares = 0, 0.0, 0.0
+        for s, start in zip(self.series, self.starts):
+            for i in range(start - self.window, len(s) - 1, chunk):
+                values = np.asarray(s[i:min(i + chunk, len(s) - 1)],
+                                    dtype=float)
+                n += len(values)
+                total += values.sum()
+                squares += (values ** 2).sum()
+        mean = total / n
+        return mean, np.sqrt((squares - n * mean ** 2) / (n - 1))
+
+
+def from_store(symbols, window, start=None, end=None, source=None,
+               **kwargs):
+    """Returns a WindowDataset over the stored returns of symbols (see
+    feature_store) within [start, end]; the series are memmap views."""
+    series = []
+    for symbol in symbols:
+        store = update_features(symbol, source)
+        i, j = store.bounds(symbol, start, end)
+        series.append(store.column(symbol, 'return')[i:j])
+    return WindowDataset(series, window, **kwargs)